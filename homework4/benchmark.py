@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import utility
+from generate_log import generate_log, parse_size
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+OPERATIONS = {
+        'popular_resource': -2,
+        'popular_user': 0}
+
+# Способы подсчёта: функция (путь, номер столбца) -> ответ.
+# Первый способ — эталон, с которым сравниваются остальные
+ENGINES = {
+        'baseline': lambda path, column: utility.get_max_key({
+                key.encode(utility.ENCODING): count
+                for key, count in utility.count_column_values_by_lines(
+                        path, column).items()}),
+        'split': lambda path, column: utility.get_max_key(
+                utility.count_values(path, (column,), parser='split')[0]),
+        'projection': lambda path, column: utility.get_max_key(
+                utility.count_values(path, (column,))[0]),
+        'parallel': lambda path, column: utility.get_max_key(
+                utility.count_values(path, (column,), workers=0)[0]),
+        'approximate': lambda path, column: utility.get_max_key(
+                utility.count_values(path, (column,), capacity=1000)[0])}
+
+
+def get_peak_rss():
+    """
+    Возвращает наибольший объём резидентной памяти текущего процесса
+    и его потомков в мегабайтах (None, если узнать его нельзя)
+    """
+    if resource is None:
+        return None
+    scale = 2 ** 20 if os.uname().sysname == 'Darwin' else 2 ** 10
+    return max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+
+def run_engine(engine: str, path: str, column: int):
+    """
+    Выполняет подсчёт способом engine и возвращает ответ,
+    время работы в секундах и пиковую память в мегабайтах
+    """
+    start = time.perf_counter()
+    answer = ENGINES[engine](path, column)
+    return answer, time.perf_counter() - start, get_peak_rss()
+
+
+def measure(engine: str, path: str, column: int):
+    """
+    Запускает run_engine в отдельном процессе, чтобы пиковая память
+    одного замера не влияла на другие
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_engine, engine, path, column).result()
+
+
+def prepare_log(directory: str, size: int, args):
+    """
+    Возвращает путь до сгенерированного лога и число строк в нём.
+    Уже сгенерированный с теми же параметрами лог используется повторно.
+    """
+    path = os.path.join(directory, 'log_{}_{}_{}_{}_{}.txt'.format(
+            size, args.users, args.resources, args.skew, args.seed))
+    if not os.path.exists(path):
+        generate_log(
+                path, size, args.users, args.resources, args.skew, args.seed)
+    lines = 0
+    for chunk in utility.iter_chunks(path):
+        lines += chunk.count(b'\n')
+    return path, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark of utility.py on synthetic logs')
+    parser.add_argument(
+            '--sizes', default='10M,100M,1G,10G',
+            help='comma separated sizes of logs')
+    parser.add_argument(
+            '--engines', default=','.join(ENGINES),
+            help='comma separated engines: ' + ', '.join(ENGINES))
+    parser.add_argument(
+            '--operations', default=','.join(OPERATIONS),
+            help='comma separated operations: ' + ', '.join(OPERATIONS))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--resources', type=int, default=10000)
+    parser.add_argument('--skew', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+            '--dir', default=os.path.join(tempfile.gettempdir(), 'log_bench'),
+            help='directory for generated logs')
+    args = parser.parse_args()
+    engines = args.engines.split(',')
+    operations = args.operations.split(',')
+    for name in engines:
+        if name not in ENGINES:
+            parser.error('unknown engine {}'.format(name))
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error('unknown operation {}'.format(name))
+    os.makedirs(args.dir, exist_ok=True)
+
+    row = '{:>8} {:>16} {:>12} {:>9} {:>9} {:>12} {:>9} {:>8} {:>6}'
+    print(row.format(
+            'size', 'operation', 'engine', 'seconds', 'MB/s', 'lines/s',
+            'peak MB', 'speedup', 'same'))
+    for size in map(parse_size, args.sizes.split(',')):
+        path, lines = prepare_log(args.dir, size, args)
+        megabytes = os.path.getsize(path) / 2 ** 20
+        for operation in operations:
+            reference = None
+            for engine in engines:
+                answer, seconds, peak = measure(
+                        engine, path, OPERATIONS[operation])
+                if reference is None:
+                    reference = answer, seconds
+                print(row.format(
+                        '{:.0f}M'.format(megabytes), operation, engine,
+                        '{:.2f}'.format(seconds),
+                        '{:.1f}'.format(megabytes / seconds),
+                        '{:.0f}'.format(lines / seconds),
+                        '-' if peak is None else '{:.0f}'.format(peak),
+                        '{:.2f}'.format(reference[1] / seconds),
+                        'yes' if answer == reference[0] else 'no'),
+                        flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import itertools
+import random
+
+LINE_FORMAT = (
+        '{user}, -, {date}, {time}, W3SVC2, SALES1, 172.21.13.45, {taken}, '
+        '{received}, {sent}, {status}, 0, {method}, {resource}, -,\n')
+STATUSES = ('200', '200', '200', '200', '304', '404', '500')
+METHODS = ('GET', 'GET', 'GET', 'POST', 'HEAD')
+START = datetime.datetime(2021, 3, 1)
+BATCH = 10000
+
+
+def parse_size(size: str):
+    """
+    Возвращает число байт по строке вида '10M', '1G' или '512'
+    """
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def make_cum_weights(count: int, skew: float):
+    """
+    Возвращает накопленные веса распределения Ципфа с показателем skew
+    для count значений (skew = 0 — равномерное распределение)
+    """
+    return list(itertools.accumulate(
+            1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def generate_log(
+        path: str, size: int, users: int = 10000, resources: int = 10000,
+        skew: float = 1.0, seed: int = 0, seconds_per_line: float = 0.01):
+    """
+    Записывает в path лог из строк в формате утилиты (15 столбцов, как
+    в журналах IIS) размером не меньше size байт и возвращает число строк.
+    users и resources задают число различных клиентов и ресурсов, skew —
+    показатель распределения Ципфа для их популярности. При одинаковых
+    параметрах получается одинаковый файл.
+    """
+    rnd = random.Random(seed)
+    user_names = [
+            '10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255, i & 255)
+            for i in rnd.sample(range(1, 2 ** 24), users)]
+    resource_names = [
+            '/{}/page{}.html'.format(rnd.choice('abcdefgh'), i)
+            for i in range(resources)]
+    rnd.shuffle(resource_names)
+    user_weights = make_cum_weights(users, skew)
+    resource_weights = make_cum_weights(resources, skew)
+    written = lines = 0
+    with open(path, 'w', encoding='cp1251', newline='\n') as file:
+        while written < size:
+            batch = list()
+            for user, resource in zip(
+                    rnd.choices(user_names, cum_weights=user_weights, k=BATCH),
+                    rnd.choices(
+                            resource_names, cum_weights=resource_weights,
+                            k=BATCH)):
+                moment = START + datetime.timedelta(
+                        seconds=lines * seconds_per_line)
+                lines += 1
+                batch.append(LINE_FORMAT.format(
+                        user=user, resource=resource,
+                        date=moment.strftime('%m/%d/%y'),
+                        time='{}:{:02}:{:02}'.format(
+                                moment.hour, moment.minute, moment.second),
+                        taken=rnd.randint(1, 10000),
+                        received=rnd.randint(100, 1000),
+                        sent=rnd.randint(100, 100000),
+                        status=rnd.choice(STATUSES),
+                        method=rnd.choice(METHODS)))
+            data = ''.join(batch)
+            file.write(data)
+            written += len(data)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Generator of synthetic logs for utility.py')
+    parser.add_argument('path', help='where to write the log')
+    parser.add_argument(
+            '--size', default='10M', help='size of the log, e.g. 10M or 1G')
+    parser.add_argument(
+            '--users', type=int, default=10000,
+            help='number of distinct clients')
+    parser.add_argument(
+            '--resources', type=int, default=10000,
+            help='number of distinct resources')
+    parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Zipf exponent of key popularity, 0 for uniform')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    print(generate_log(
+            args.path, parse_size(args.size), args.users, args.resources,
+            args.skew, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+import random
+import tempfile
+import unittest
+
+import utility as u
+from generate_log import generate_log, parse_size
+
+
+def make_line(user, resource, extra='', date='03/20/98', time='7:55:20'):
+    return (
+            '{}, -, {}, {}, W3SVC2, SALES1, 172.21.13.45, 4502, '
+            '163, 3223, 200, 0, GET, {}, -,{}\n'.format(
+                    user, date, time, resource, extra))
+
+
+class TestScanEngine(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, 'log.txt')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, data: bytes):
+        with open(self._path, 'wb') as file:
+            file.write(data)
+
+    def _check_same_as_reference(self):
+        for column in (0, -2):
+            with self.subTest(column=column):
+                expected = u.count_column_values_by_lines(self._path, column)
+                actual = u.count_column_values(self._path, column)
+                self.assertDictEqual(
+                        expected,
+                        {k.decode(u.ENCODING): v for k, v in actual.items()})
+
+    def test_empty_file(self):
+        self._write(b'')
+        self.assertIsNone(u.find_most_popular_resource(self._path))
+        self.assertIsNone(u.find_most_active_user(self._path))
+
+    def test_random_log(self):
+        rnd = random.Random(42)
+        lines = [
+                make_line(
+                        '10.0.0.{}'.format(rnd.randint(1, 20)),
+                        '/page{}.html'.format(rnd.randint(1, 50)))
+                for _ in range(3000)]
+        lines.append('broken, line\n')
+        self._write(''.join(lines).encode(u.ENCODING))
+        self._check_same_as_reference()
+
+    def test_empty_and_blank_fields(self):
+        self._write(
+                (make_line('a', '/x', extra=' , ,') +
+                 make_line('a', '/y').replace(', -,', ',  ,', 1) +
+                 make_line('\xa0b\xa0', '/ресурс') +
+                 make_line('b', '/ресурс')).encode(u.ENCODING))
+        self._check_same_as_reference()
+        self.assertEqual(u.find_most_popular_resource(self._path), '/ресурс')
+
+    def test_line_endings(self):
+        self._write(
+                (make_line('a', '/x').replace('\n', '\r\n') +
+                 make_line('b', '/y').replace('\n', '\r') +
+                 make_line('b', '/y')).encode(u.ENCODING))
+        self.assertEqual(u.find_most_active_user(self._path), 'b')
+        self.assertDictEqual(
+                u.count_column_values(self._path, -2), {b'/x': 1, b'/y': 2})
+
+    def test_ties_resolved_by_first_occurrence(self):
+        self._write(
+                (make_line('a', '/x') + make_line('b', '/y') +
+                 make_line('b', '/x') + make_line('a', '/y')).encode(
+                        u.ENCODING))
+        self.assertEqual(u.find_most_active_user(self._path), 'a')
+        self.assertEqual(u.find_most_popular_resource(self._path), '/x')
+
+    def test_chunk_boundaries(self):
+        old_chunk_size = u.CHUNK_SIZE
+        u.CHUNK_SIZE = 7
+        try:
+            self._write(''.join(
+                    make_line('u{}'.format(i % 3), '/r{}'.format(i % 5))
+                    for i in range(100)).encode(u.ENCODING))
+            self._check_same_as_reference()
+        finally:
+            u.CHUNK_SIZE = old_chunk_size
+
+    def test_split_file_is_line_aligned(self):
+        data = ''.join(
+                make_line('u{}'.format(i), '/r') for i in range(50)).encode()
+        self._write(data)
+        for parts in (1, 2, 3, 7, 100):
+            with self.subTest(parts=parts):
+                ranges = u.split_file(self._path, parts)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], len(data))
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                    self.assertEqual(data[start - 1:start], b'\n')
+
+    def test_parallel_same_as_serial(self):
+        rnd = random.Random(7)
+        self._write(''.join(
+                make_line(
+                        'u{}'.format(rnd.randint(1, 10)),
+                        '/r{}'.format(rnd.randint(1, 10)))
+                for _ in range(2000)).encode(u.ENCODING))
+        for column in (0, -2):
+            serial = u.count_column_values(self._path, column)
+            parallel = u.count_column_values_parallel(self._path, column, 3)
+            self.assertListEqual(list(serial.items()), list(parallel.items()))
+
+    def test_statistics_in_one_pass(self):
+        self._write(
+                (make_line('a', '/x') + make_line('b', '/y') +
+                 make_line('b', '/x') + make_line('c', '/x')).encode(
+                        u.ENCODING))
+        stat = u.get_statistics(self._path, (0, -2), top=2)
+        self.assertEqual(stat['lines'], 4)
+        self.assertListEqual(
+                stat['columns']['0'],
+                [{'value': 'b', 'count': 2}, {'value': 'a', 'count': 1}])
+        self.assertListEqual(
+                stat['columns']['-2'],
+                [{'value': '/x', 'count': 3}, {'value': '/y', 'count': 1}])
+        self.assertDictEqual(
+                stat, u.get_statistics(self._path, (0, -2), 2, workers=2))
+
+    def test_approximate_mode_finds_heavy_hitters(self):
+        rnd = random.Random(1)
+        users = ['heavy'] * 300 + ['u{}'.format(i) for i in range(700)]
+        rnd.shuffle(users)
+        self._write(''.join(
+                make_line(user, '/r{}'.format(i % 3))
+                for i, user in enumerate(users)).encode(u.ENCODING))
+        self.assertEqual(
+                u.find_most_active_user(self._path, capacity=20), 'heavy')
+        self.assertEqual(
+                u.find_most_popular_resource(self._path, capacity=20), '/r0')
+        stat = u.get_statistics(self._path, (0,), top=1, capacity=20)
+        heavy = stat['columns']['0'][0]
+        self.assertEqual(stat['lines'], 1000)
+        self.assertLessEqual(heavy['count'] - heavy['error'], 300)
+        self.assertGreaterEqual(heavy['count'], 300)
+        self.assertLessEqual(heavy['error'], 1000 // 20)
+
+    def test_checkpoint_processes_only_appended_lines(self):
+        checkpoint = os.path.join(self._dir.name, 'state.json')
+        self._write((make_line('a', '/x') + make_line('a', '/y')).encode())
+        self.assertEqual(
+                u.find_most_active_user(self._path, checkpoint=checkpoint),
+                'a')
+        with open(self._path, 'ab') as file:
+            file.write((make_line('b', '/y') * 3).encode())
+            file.write(make_line('c', '/z').encode()[:20])
+        old_iter_chunks = u.iter_chunks
+        scanned = list()
+        u.iter_chunks = lambda path, start, end: (
+                scanned.append((start, end)) or old_iter_chunks(
+                        path, start, end))
+        try:
+            stats = u.count_values(self._path, (0,), checkpoint=checkpoint)
+        finally:
+            u.iter_chunks = old_iter_chunks
+        self.assertDictEqual(stats[0], {b'a': 2, b'b': 3})
+        self.assertEqual(scanned[0][0], 2 * len(make_line('a', '/x')))
+        self.assertEqual(scanned[0][1], 5 * len(make_line('a', '/x')))
+
+    def test_checkpoint_detects_rotation(self):
+        checkpoint = os.path.join(self._dir.name, 'state.json')
+        self._write((make_line('a', '/x') * 3).encode())
+        u.count_values(self._path, (0,), checkpoint=checkpoint)
+        self._write(make_line('b', '/x').encode())
+        stats = u.count_values(self._path, (0,), checkpoint=checkpoint)
+        self.assertDictEqual(stats[0], {b'b': 1})
+        self._write((make_line('b', '/x') * 2).encode())
+        stats = u.count_values(
+                self._path, (0,), workers=2, capacity=5,
+                checkpoint=checkpoint)
+        self.assertListEqual(stats[0].most_common(1), [(b'b', 2, 0)])
+
+    def test_compressed_and_several_files(self):
+        rnd = random.Random(5)
+        lines = [
+                make_line(
+                        'u{}'.format(rnd.randint(1, 9)),
+                        '/r{}'.format(rnd.randint(1, 9)))
+                for _ in range(900)]
+        parts = [''.join(lines[i::3]).encode(u.ENCODING) for i in range(3)]
+        self._write(b''.join(parts))
+        expected = u.count_columns_values(self._path, (0, -2))
+        paths = list()
+        for part, opener, extension in zip(
+                parts, (gzip.open, bz2.open, lzma.open), ('gz', 'bz2', 'xz')):
+            paths.append(
+                    os.path.join(self._dir.name, 'log.1.' + extension))
+            with opener(paths[-1], 'wb') as file:
+                file.write(part)
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                actual = u.count_values(paths, (0, -2), workers)
+                self.assertDictEqual(expected[0], actual[0])
+                self.assertDictEqual(expected[1], actual[1])
+        self.assertListEqual(
+                u.expand_paths([os.path.join(self._dir.name, 'log.1.*')]),
+                sorted(paths))
+
+    def test_stream_chunks(self):
+        old_chunk_size = u.CHUNK_SIZE
+        u.CHUNK_SIZE = 5
+        try:
+            with gzip.open(self._path, 'wb') as file:
+                file.write(b'abc\ndefghijk\nlm\nno end')
+            with gzip.open(self._path, 'rb') as file:
+                chunks = list(u.iter_stream_chunks(file))
+        finally:
+            u.CHUNK_SIZE = old_chunk_size
+        self.assertEqual(b''.join(chunks), b'abc\ndefghijk\nlm\nno end')
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b'\n'))
+
+    def test_index(self):
+        rnd = random.Random(11)
+        self._write(''.join(
+                make_line(
+                        'u{}'.format(rnd.randint(1, 30)),
+                        '/r{}'.format(rnd.randint(1, 30)))
+                for _ in range(1000)).encode(u.ENCODING))
+        expected = u.get_statistics(self._path, (0, -2, 13), top=5)
+        index_path = u.build_index(self._path, (0, -2))
+        self.assertEqual(index_path, self._path + u.INDEX_SUFFIX)
+        old_count_values = u.count_values
+        u.count_values = None
+        try:
+            self.assertDictEqual(
+                    u.get_statistics(self._path, (0, -2, 13), top=5),
+                    expected)
+            self.assertEqual(
+                    u.find_most_active_user(self._path),
+                    expected['columns']['0'][0]['value'])
+        finally:
+            u.count_values = old_count_values
+        self.assertIsNone(u.query_index(self._path, (0, 3), 5))
+
+    def test_stale_index_is_rejected(self):
+        self._write(make_line('a', '/x').encode())
+        u.build_index(self._path, (0,))
+        with open(self._path, 'ab') as file:
+            file.write((make_line('b', '/x') * 2).encode())
+        self.assertIsNone(u.query_index(self._path, (0,), 1))
+        self.assertEqual(u.find_most_active_user(self._path), 'b')
+
+    def test_damaged_index_is_ignored(self):
+        self._write((make_line('a', '/x') * 3 + make_line('b', '/y')).encode())
+        index_path = u.build_index(self._path, (0, -2))
+        index_size = os.path.getsize(index_path)
+        for size in (20, index_size - 1):
+            with self.subTest(size=size):
+                os.truncate(index_path, size)
+                with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                    self.assertIsNone(u.query_index(self._path, (0,), 1))
+                    self.assertEqual(u.find_most_active_user(self._path), 'a')
+                self.assertIn('повреждён', stderr.getvalue())
+        with open(self._path + '.tmp', 'wb'):
+            pass
+        self.assertListEqual(
+                u.expand_paths([self._path + '*']), [self._path])
+
+    def test_buckets(self):
+        self._write(''.join((
+                make_line('a', '/x', time='7:55:20'),
+                make_line('b', '/x', time='7:59:59'),
+                make_line('b', '/y', time='8:00:00'),
+                make_line('b', '/y', date='03/20/1998', time='8:04:00'),
+                make_line('c', '/z', date='03/21/98', time='0:00:01'),
+                make_line('d', '/z', time='bad'))).encode())
+        stat = u.get_bucket_statistics(self._path, (0, -2), 3600, top=1)
+        self.assertEqual(stat['bucket'], 3600)
+        self.assertListEqual(
+                [(b['start'], b['lines']) for b in stat['buckets']],
+                [('1998-03-20 07:00:00', 2),
+                 ('1998-03-20 08:00:00', 2),
+                 ('1998-03-21 00:00:00', 1)])
+        self.assertListEqual(
+                stat['buckets'][1]['columns']['0'],
+                [{'value': 'b', 'count': 2, 'error': 0}])
+        stat = u.get_bucket_statistics(self._path, (0,), 300, top=1)
+        self.assertListEqual(
+                [b['start'][-8:] for b in stat['buckets']],
+                ['07:55:00', '08:00:00', '00:00:00'])
+
+    def test_generated_log(self):
+        lines = generate_log(self._path, 50000, users=20, resources=30)
+        with open(self._path, 'rb') as file:
+            data = file.read()
+        other_path = self._path + '.2'
+        self.assertEqual(
+                generate_log(other_path, 50000, users=20, resources=30),
+                lines)
+        with open(other_path, 'rb') as file:
+            self.assertEqual(file.read(), data)
+        self.assertGreaterEqual(len(data), 50000)
+        users, resources = u.count_values(self._path, (0, -2))
+        self.assertEqual(sum(users.values()), lines)
+        self.assertLessEqual(len(users), 20)
+        self.assertLessEqual(len(resources), 30)
+        self.assertEqual(parse_size('10M'), 10 * 2 ** 20)
+
+
+def reference_columns(line: bytes):
+    """Разбор строки так, как это делала исходная реализация утилиты"""
+    columns = list(
+            filter(
+                    lambda l: len(l) > 0,
+                    map(lambda l: l.strip(),
+                        line.decode(u.ENCODING).split(','))))
+    return columns if len(columns) == u.COLUMNS_COUNT else None
+
+
+class TestLineParsers(unittest.TestCase):
+    FIELDS = ['', ' ', '\xa0', '\t', '\x1c', 'a', ' b ', '\xa0c', 'ресурс']
+
+    def setUp(self):
+        rnd = random.Random(2)
+        self.lines = [
+                make_line('a', '/x').rstrip('\n').encode(u.ENCODING),
+                make_line('a', '/x', extra=' ,').encode(u.ENCODING),
+                b'', b',' * 14, b'a,' * 15, b',' + b'a,' * 15]
+        for _ in range(3000):
+            fields = [
+                    rnd.choice(self.FIELDS) if rnd.random() < 0.3 else 'f'
+                    for _ in range(rnd.randint(13, 18))]
+            self.lines.append(','.join(fields).encode(u.ENCODING))
+
+    def _check(self, column_numbers):
+        expected = list()
+        for line in self.lines:
+            columns = reference_columns(line)
+            expected.append(None if columns is None else [
+                    columns[number].encode(u.ENCODING)
+                    for number in column_numbers])
+        for name, make_parser in u.LINE_PARSERS.items():
+            with self.subTest(parser=name, columns=column_numbers):
+                self.assertListEqual(
+                        list(map(make_parser(column_numbers), self.lines)),
+                        expected)
+
+    def test_every_single_column(self):
+        for number in range(-u.COLUMNS_COUNT, u.COLUMNS_COUNT):
+            self._check((number,))
+
+    def test_several_columns(self):
+        for column_numbers in ((0, -2), (13, 12), (0, 3), (2, 3, 0, -2)):
+            self._check(column_numbers)
+
+    def test_parsers_give_same_counts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log.txt')
+            with open(path, 'wb') as file:
+                file.write(b'\n'.join(self.lines))
+            expected = u.count_values(path, (0, -2), parser='split')
+            for name in u.LINE_PARSERS:
+                with self.subTest(parser=name):
+                    self.assertListEqual(
+                            u.count_values(path, (0, -2), parser=name),
+                            expected)
+
+
+class TestSpaceSaving(unittest.TestCase):
+    def test_exact_when_capacity_is_enough(self):
+        summary = u.SpaceSaving(10)
+        summary.update({'a': 3, 'b': 5})
+        summary.add('a')
+        self.assertListEqual(
+                summary.most_common(5), [('b', 5, 0), ('a', 4, 0)])
+
+    def test_bounds(self):
+        rnd = random.Random(3)
+        items = [rnd.choice('aaaaabbbcdefghijklmnop') for _ in range(5000)]
+        summary = u.SpaceSaving(5)
+        for item in items:
+            summary.add(item)
+        self.assertEqual(len(summary), 5)
+        self.assertEqual(summary.total, len(items))
+        for key, count, error in summary.most_common(5):
+            with self.subTest(key=key):
+                self.assertLessEqual(error, len(items) // 5)
+                self.assertLessEqual(count - error, items.count(key))
+                self.assertGreaterEqual(count, items.count(key))
+
+    def test_merge(self):
+        first, second = u.SpaceSaving(2), u.SpaceSaving(2)
+        first.update({'a': 5, 'b': 1, 'c': 1})
+        second.update({'a': 2, 'd': 4})
+        first.merge(second)
+        self.assertEqual(first.total, 13)
+        key, count, error = first.most_common(1)[0]
+        self.assertEqual(key, 'a')
+        self.assertGreaterEqual(count, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,146 @@
+import bz2
+import datetime
+import glob
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import lzma
+import mmap
 import os
+import operator
 import os.path
+import shutil
 import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 
-MODES = Enum('MODES', 'POPULAR_RESOURCE POPULAR_USER HELP')
+MODES = Enum(
+        'MODES',
+        'POPULAR_RESOURCE POPULAR_USER STATISTICS BUCKETS BUILD_INDEX HELP')
+
+ENCODING = 'cp1251'
+COLUMNS_COUNT = 15
+CHUNK_SIZE = 10 * 1024 * 1024
+FIRST_LINE_LIMIT = 64 * 1024
+INDEX_MAGIC = b'LOGIDX1\n'
+INDEX_SUFFIX = '.idx'
+# Столбцы с датой и временем запроса
+DATE_COLUMN = 2
+TIME_COLUMN = 3
+# Сколько значений на каждое место в топе хранить для интервала времени
+BUCKET_CAPACITY_FACTOR = 10
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+# Байты, которые после декодирования из cp1251 str.strip() считает пробельными
+_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\xa0'
+_STRIP_ARGS = itertools.repeat(_WHITESPACE)
+
+# Разборщик строк лога по умолчанию (см. LINE_PARSERS)
+DEFAULT_PARSER = 'projection'
+
+# Сигнатуры сжатых файлов и функции для их потокового чтения
+COMPRESSED_FORMATS = (
+        (b'\x1f\x8b', gzip.open),
+        (b'BZh', bz2.open),
+        (b'\xfd7zXZ\x00', lzma.open))
+
+# Именованные параметры утилиты и их значения по умолчанию
+OPTIONS = {
+        '--workers': 1, '--columns': '0,-2', '--top': 10, '--capacity': 0,
+        '--checkpoint': '', '--bucket': 3600}
 
 
 def get_arguments():
     """
-    Возвращает путь до файла с логами и режим работы
+    Возвращает список путей до файлов с логами, режим работы
+    и словарь именованных параметров
     """
-    arguments = sys.argv[1:]
+    arguments, options = extract_options(sys.argv[1:])
     check_arguments_for_errors(arguments)
-    if len(arguments) > 1:
-        return arguments[0], get_mode_by_name(arguments[1])
-    return None, get_mode_by_name(arguments[0])
+    mode = get_mode_by_name(arguments[-1])
+    if mode is MODES.HELP:
+        return None, mode, options
+    file_paths = expand_paths(arguments[:-1])
+    if options['checkpoint'] is not None and (
+            len(file_paths) > 1 or get_opener(file_paths[0]) is not None):
+        report_error(
+                'Контрольная точка поддерживается только '
+                'для одного несжатого файла', 1)
+    return file_paths, mode, options
+
+
+def expand_paths(patterns: list):
+    """
+    Возвращает список файлов по списку путей и шаблонов вида 'access*.gz'.
+    Индексы логов и недописанные временные файлы шаблоном не выбираются
+    """
+    file_paths = list()
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            file_paths.append(pattern)
+        else:
+            file_paths.extend(sorted(
+                    path for path in glob.glob(pattern)
+                    if os.path.isfile(path)
+                    and not path.endswith((INDEX_SUFFIX, '.tmp'))))
+    return file_paths
+
+
+def extract_options(arguments: list):
+    """
+    Отделяет именованные параметры вида '--name value' от позиционных.
+    Возвращает список позиционных аргументов и словарь параметров,
+    в котором отсутствующие параметры имеют значения по умолчанию
+    """
+    positional = list()
+    options = {name[2:]: value for name, value in OPTIONS.items()}
+    arguments = iter(arguments)
+    for argument in arguments:
+        if not argument.startswith('--'):
+            positional.append(argument)
+            continue
+        if argument not in OPTIONS:
+            report_error('Неизвестный параметр {}'.format(argument), 1)
+        value = next(arguments, None)
+        if value is None:
+            report_error(
+                    'Не указано значение параметра {}'.format(argument), 1)
+        try:
+            options[argument[2:]] = type(OPTIONS[argument])(value)
+        except ValueError:
+            report_error(
+                    'Некорректное значение параметра {}: {}'.format(
+                            argument, value), 1)
+    if options['workers'] < 0:
+        report_error('Число процессов не может быть отрицательным', 1)
+    if options['top'] < 1:
+        report_error('Размер топа должен быть положительным', 1)
+    if options['capacity'] < 0:
+        report_error('Число счётчиков не может быть отрицательным', 1)
+    if options['bucket'] < 1:
+        report_error('Длина интервала должна быть положительной', 1)
+    options['columns'] = parse_column_numbers(options['columns'])
+    options['checkpoint'] = options['checkpoint'] or None
+    return positional, options
+
+
+def parse_column_numbers(columns: str):
+    """
+    Возвращает кортеж номеров столбцов из строки вида '0,-2'
+    """
+    try:
+        column_numbers = tuple(int(column) for column in columns.split(','))
+    except ValueError:
+        column_numbers = ()
+    if not column_numbers or not all(
+            -COLUMNS_COUNT <= number < COLUMNS_COUNT
+            for number in column_numbers):
+        report_error('Некорректный список столбцов: {}'.format(columns), 1)
+    return column_numbers
 
 
 def check_arguments_for_errors(arguments: list):
@@ -31,15 +157,15 @@ def check_arguments_for_errors(arguments: list):
             report_error('Не указан режим работы утилиты', 1)
         else:
             report_error('Не указан путь до файла с логами', 1)
-    mode_name = arguments[1]
+    mode_name = arguments[-1]
     mode = get_mode_by_name(mode_name)
     if mode is None:
         report_error('Неизвестный параметр {}\n'.format(mode_name), 1)
     elif mode is MODES.HELP:
         return
-    filepath = arguments[0]
-    if not (os.path.exists(filepath) and os.path.isfile(filepath)):
-        report_error('Файл {} не найден'.format(filepath), 2)
+    for pattern in arguments[:-1]:
+        if not expand_paths([pattern]):
+            report_error('Файл {} не найден'.format(pattern), 2)
 
 
 def report_error(error_message: str, error_code: int):
@@ -58,7 +184,7 @@ def get_mode_by_name(mode_name: str):
     """
     Возвращает элемент перечисления MODES по имени
     """
-    mode_name = mode_name.lower()
+    mode_name = mode_name.lower().replace('-', '_')
     for mode in MODES:
         if mode.name.lower() == mode_name:
             return mode
@@ -90,29 +216,968 @@ def read_lines(file_path: str, start_byte: int, max_bytes: int):
         return lines if lines else None, start_byte + number_of_bytes_read
 
 
-def find_most_popular_resource(file_path: str):
+def find_most_popular_resource(
+        file_path: str, workers: int = 1, capacity: int = 0,
+        checkpoint: str = None):
     """
     Возвращает самый популярный ресурс.
     Если найти такой не получилось, возвращает None.
     """
-    return get_max_of_column_from_file(file_path, -2)
+    return get_max_of_column_from_file(
+            file_path, -2, workers, capacity, checkpoint)
 
 
-def find_most_active_user(file_path: str):
+def find_most_active_user(
+        file_path: str, workers: int = 1, capacity: int = 0,
+        checkpoint: str = None):
     """
     Возвращает самого активного клиента.
     Если найти такого не получилось, возвращает None.
     """
-    return get_max_of_column_from_file(file_path, 0)
+    return get_max_of_column_from_file(
+            file_path, 0, workers, capacity, checkpoint)
 
 
-def get_max_of_column_from_file(file_path: str, column_number: int):
+def get_max_of_column_from_file(
+        file_path: str, column_number: int,
+        workers: int = 1, capacity: int = 0, checkpoint: str = None):
     """
     Возвращает максимальный элемент из столбца в указнном файле лога.
     Если найти такой не получилось, возвращает None.
+    При workers > 1 файл обрабатывается параллельно в нескольких процессах,
+    при workers == 0 — во стольких процессах, сколько ядер в системе.
+    При capacity > 0 подсчёт приближённый и хранит не более capacity
+    значений (см. SpaceSaving).
+    Если указан файл checkpoint, обрабатывается только часть лога,
+    дописанная после предыдущего запуска (см. count_values).
+    """
+    indexed = query_index_if_possible(
+            file_path, (column_number,), 1, capacity, checkpoint)
+    if indexed is not None:
+        column_top = indexed[1][0]
+        return decode_key(column_top[0][0]) if column_top else None
+    return get_max_key(count_values(
+            file_path, (column_number,), workers, capacity, checkpoint)[0])
+
+
+def get_statistics(
+        file_path: str, column_numbers, top: int = 10,
+        workers: int = 1, capacity: int = 0, checkpoint: str = None):
+    """
+    За один проход по логу возвращает для каждого столбца из column_numbers
+    top самых частых значений вместе с количеством их появлений.
+    Результат — словарь, пригодный для сериализации в JSON:
+    {'lines': число учтённых строк,
+     'columns': {'номер столбца': [{'value': значение, 'count': число}, ...]}}
+    При capacity > 0 подсчёт приближённый: у каждого значения появляется
+    поле 'error' — насколько 'count' может превышать истинную частоту.
+    Если для лога построен актуальный индекс, ответ берётся из него.
+    """
+    indexed = query_index_if_possible(
+            file_path, column_numbers, top, capacity, checkpoint)
+    if indexed is not None:
+        rows, tops = indexed
+        return {
+                'lines': rows,
+                'columns': {
+                        str(column_number): [
+                                {'value': decode_key(key), 'count': count}
+                                for key, count in column_top]
+                        for column_number, column_top in zip(
+                                column_numbers, tops)}}
+    stats = count_values(
+            file_path, column_numbers, workers, capacity, checkpoint)
+    return {
+            'lines': get_total(stats[0]) if stats else 0,
+            'columns': {
+                    str(column_number): get_top(stat, top)
+                    for column_number, stat in zip(column_numbers, stats)}}
+
+
+def get_bucket_statistics(
+        file_path, column_numbers, bucket: int = 3600, top: int = 10,
+        capacity: int = 0):
+    """
+    За один проход по логу делит строки на интервалы времени длиной
+    bucket секунд и возвращает для каждого интервала и каждого столбца
+    из column_numbers top самых частых значений. Частоты считаются
+    в SpaceSaving с capacity значениями (по умолчанию BUCKET_CAPACITY_FACTOR
+    на каждое место в топе), поэтому память ограничена числом интервалов,
+    умноженным на capacity. Строки с некорректным временем пропускаются.
+    Результат — словарь, пригодный для сериализации в JSON:
+    {'bucket': bucket,
+     'buckets': [{'start': 'ГГГГ-ММ-ДД чч:мм:сс', 'lines': число строк,
+                  'columns': {'номер столбца': [{'value': значение,
+                                                'count': число,
+                                                'error': ошибка}, ...]}},
+                 ...]}
+    """
+    capacity = capacity or top * BUCKET_CAPACITY_FACTOR
+    buckets = dict()
+    for path in as_path_list(file_path):
+        for start, (lines, summaries) in count_buckets(
+                path, column_numbers, bucket, capacity).items():
+            if start in buckets:
+                buckets[start][0] += lines
+                for summary, other in zip(buckets[start][1], summaries):
+                    summary.merge(other)
+            else:
+                buckets[start] = [lines, summaries]
+    return {
+            'bucket': bucket,
+            'buckets': [
+                    {
+                            'start': time.strftime(
+                                    '%Y-%m-%d %H:%M:%S', time.gmtime(start)),
+                            'lines': lines,
+                            'columns': {
+                                    str(column_number): get_top(summary, top)
+                                    for column_number, summary in zip(
+                                            column_numbers, summaries)}}
+                    for start, (lines, summaries) in sorted(
+                            buckets.items())]}
+
+
+def count_values(
+        file_path: str, column_numbers, workers: int = 1, capacity: int = 0,
+        checkpoint: str = None, parser: str = DEFAULT_PARSER):
+    """
+    Возвращает список счётчиков значений столбцов column_numbers,
+    используя workers процессов (0 — по числу ядер). Счётчики — словари
+    частот либо, при capacity > 0, объекты SpaceSaving.
+
+    Если указан файл checkpoint, из него берутся счётчики и позиция,
+    до которой лог был обработан в прошлый раз, и обрабатываются только
+    дописанные с тех пор полные строки. Если лог был ротирован или усечён,
+    либо прошлый запуск считал другие столбцы, лог обрабатывается заново.
+    После подсчёта состояние сохраняется в checkpoint.
+    Контрольная точка поддерживается только для одного несжатого файла.
+
+    file_path — путь до файла лога либо список путей; счётчики по всем
+    файлам складываются. Файлы, сжатые gzip, bzip2 или xz, распаковываются
+    на лету, без временных файлов.
+
+    parser — имя разборщика строк из LINE_PARSERS.
+    """
+    file_paths = as_path_list(file_path)
+    start, end, previous = 0, None, None
+    if checkpoint is not None:
+        start, previous = load_checkpoint(
+                checkpoint, file_paths[0], column_numbers, capacity)
+        end = find_last_line_end(file_paths[0], start)
+    if workers == 1:
+        stats = merge_parts(
+                [count_columns_values(
+                        path, column_numbers, start, end, capacity, parser)
+                 for path in file_paths],
+                column_numbers, capacity)
+    else:
+        stats = count_columns_values_parallel(
+                file_paths, column_numbers, workers, capacity, start, end,
+                parser)
+    if previous is not None:
+        stats = [merge_stats(pair) for pair in zip(previous, stats)]
+    if checkpoint is not None:
+        save_checkpoint(
+                checkpoint, file_paths[0], column_numbers, capacity, end,
+                stats)
+    return stats
+
+
+def split_file(file_path: str, parts: int, start: int = 0, end: int = None):
+    """
+    Разбивает диапазон байт файла от start до end (по умолчанию до конца
+    файла) на не более чем parts диапазонов примерно одинакового размера,
+    границы которых совпадают с границами строк.
+    Возвращает список пар (начало, конец).
+    """
+    size = os.path.getsize(file_path)
+    end = size if end is None else min(end, size)
+    bounds = [start]
+    with open(file_path, 'rb') as file:
+        for i in range(1, parts):
+            position = start + (end - start) * i // parts
+            if position <= bounds[-1]:
+                continue
+            file.seek(position - 1)
+            file.readline()
+            position = file.tell()
+            if position >= end:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+def find_last_line_end(file_path: str, start: int = 0):
+    """
+    Возвращает позицию после последнего символа перевода строки в файле
+    (но не меньше start). Незавершённая последняя строка, которую,
+    возможно, ещё дописывают, в диапазон до этой позиции не попадает.
+    """
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= start:
+            return start
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return max(mm.rfind(b'\n', start) + 1, start)
+
+
+def get_file_identity(file_path: str):
+    """
+    Возвращает словарь, по которому можно узнать, что файл был ротирован
+    или усечён: номер inode, размер и хеш первой строки
+    """
+    with open(file_path, 'rb') as file:
+        first_line = file.readline(FIRST_LINE_LIMIT)
+        info = os.fstat(file.fileno())
+    return {
+            'inode': info.st_ino,
+            'size': info.st_size,
+            'first_line': hashlib.sha1(first_line).hexdigest()}
+
+
+def load_checkpoint(
+        checkpoint: str, file_path: str, column_numbers, capacity: int):
+    """
+    Возвращает позицию, с которой нужно продолжить обработку лога,
+    и сохранённые счётчики. Если контрольная точка отсутствует
+    или не подходит к логу, возвращает (0, None).
+    """
+    try:
+        with open(checkpoint, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return 0, None
+    except (OSError, ValueError):
+        report_error(
+                'Не удалось прочитать контрольную точку {}'.format(
+                        checkpoint), 4)
+    identity = get_file_identity(file_path)
+    try:
+        saved = state['identity']
+        if (state['file'] != os.path.abspath(file_path)
+                or state['columns'] != list(column_numbers)
+                or state['capacity'] != capacity
+                or saved['inode'] != identity['inode']
+                or saved['size'] > identity['size']
+                or saved['first_line'] != identity['first_line']):
+            return 0, None
+        return state['offset'], [
+                counter_from_json(counter, capacity)
+                for counter in state['counters']]
+    except (KeyError, TypeError, ValueError):
+        report_error(
+                'Контрольная точка {} повреждена'.format(checkpoint), 4)
+
+
+def save_checkpoint(
+        checkpoint: str, file_path: str, column_numbers, capacity: int,
+        offset: int, stats):
+    """
+    Сохраняет в контрольную точку позицию, до которой обработан лог,
+    счётчики и сведения о файле лога. Файл контрольной точки заменяется
+    целиком, поэтому прерванный запуск не оставит его испорченным.
+    """
+    identity = get_file_identity(file_path)
+    identity['size'] = offset
+    state = {
+            'file': os.path.abspath(file_path),
+            'columns': list(column_numbers),
+            'capacity': capacity,
+            'offset': offset,
+            'identity': identity,
+            'counters': [counter_to_json(stat) for stat in stats]}
+    temporary = checkpoint + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+    os.replace(temporary, checkpoint)
+
+
+def counter_to_json(stat):
+    """
+    Преобразует счётчик в список, пригодный для сериализации в JSON.
+    Байтовые ключи переводятся в строки через latin-1 без потерь.
+    """
+    if isinstance(stat, SpaceSaving):
+        return [
+                [key.decode('latin-1'), count, error]
+                for key, count, error in stat.most_common(len(stat))]
+    return [[key.decode('latin-1'), count] for key, count in stat.items()]
+
+
+def counter_from_json(data: list, capacity: int):
+    """
+    Восстанавливает счётчик из результата counter_to_json
+    """
+    if capacity:
+        stat = SpaceSaving(capacity)
+        for key, count, error in data:
+            stat.add(key.encode('latin-1'), count, error)
+        return stat
+    return {key.encode('latin-1'): count for key, count in data}
+
+
+def merge_stats(stats):
+    """
+    Складывает словари частот в порядке их следования. Порядок ключей
+    результата совпадает с порядком первого появления ключа, поэтому
+    выбор максимума при равенстве частот не зависит от разбиения файла.
+    Объекты SpaceSaving объединяются в первый из них.
+    """
+    stats = list(stats)
+    if stats and isinstance(stats[0], SpaceSaving):
+        for summary in stats[1:]:
+            stats[0].merge(summary)
+        return stats[0]
+    result = dict()
+    get = result.get
+    for stat in stats:
+        for key, count in stat.items():
+            result[key] = get(key, 0) + count
+    return result
+
+
+def count_columns_values_parallel(
+        file_path, column_numbers, workers: int = 0, capacity: int = 0,
+        start: int = 0, end: int = None, parser: str = DEFAULT_PARSER):
+    """
+    Возвращает список счётчиков значений столбцов column_numbers
+    в строках лога между позициями start и end, подсчитывая части этого
+    диапазона в пуле из workers процессов (0 — по числу ядер).
+    file_path — путь до файла либо список путей. Несжатые файлы делятся
+    на части по границам строк, сжатые обрабатываются целиком, но
+    параллельно с другими файлами.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = list()
+    for path in as_path_list(file_path):
+        if get_opener(path) is not None:
+            tasks.append((path, start, end))
+        else:
+            tasks.extend(
+                    (path, part_start, part_end)
+                    for part_start, part_end in split_file(
+                            path, workers, start, end))
+    if len(tasks) < 2:
+        return merge_parts(
+                [count_columns_values(
+                        path, column_numbers, part_start, part_end, capacity,
+                        parser)
+                 for path, part_start, part_end in tasks],
+                column_numbers, capacity)
+    paths, starts, ends = zip(*tasks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        parts = list(executor.map(
+                count_columns_values,
+                paths, [column_numbers] * len(tasks),
+                starts, ends, [capacity] * len(tasks),
+                [parser] * len(tasks)))
+    return merge_parts(parts, column_numbers, capacity)
+
+
+def merge_parts(parts: list, column_numbers, capacity: int = 0):
+    """
+    Складывает списки счётчиков столбцов column_numbers, полученные
+    для разных частей лога. Для пустого списка возвращает пустые счётчики.
+    """
+    if not parts:
+        return [
+                SpaceSaving(capacity) if capacity else dict()
+                for _ in column_numbers]
+    return [merge_stats(stats) for stats in zip(*parts)]
+
+
+def count_column_values_parallel(
+        file_path: str, column_number: int, workers: int = 0):
+    """
+    Возвращает словарь частот значений столбца column_number, подсчитывая
+    диапазоны файла в пуле из workers процессов (0 — по числу ядер)
+    """
+    return count_columns_values_parallel(
+            file_path, (column_number,), workers)[0]
+
+
+def decode_key(key: bytes):
+    """
+    Декодирует значение столбца из кодировки лога
+    """
+    try:
+        return key.decode(ENCODING)
+    except UnicodeDecodeError:
+        report_error('Ошибка при чтении файла с логами', 3)
+
+
+def get_max_key(stat):
+    """
+    Возвращает самый частый ключ из счётчика, декодированный в строку.
+    Если счётчик пуст, возвращает None.
+    """
+    if isinstance(stat, SpaceSaving):
+        top = stat.most_common(1)
+        return decode_key(top[0][0]) if top else None
+    if not stat:
+        return None
+    return decode_key(max(stat, key=lambda k: stat[k]))
+
+
+def get_top(stat, top: int):
+    """
+    Возвращает top самых частых ключей счётчика в виде списка
+    словарей {'value': ключ, 'count': частота}. При равенстве частот
+    первым идёт ключ, встретившийся раньше. Для SpaceSaving в словарях
+    есть также поле 'error' — верхняя граница ошибки частоты.
+    """
+    if isinstance(stat, SpaceSaving):
+        return [
+                {'value': decode_key(key), 'count': count, 'error': error}
+                for key, count, error in stat.most_common(top)]
+    return [
+            {'value': decode_key(key), 'count': count}
+            for key, count in heapq.nlargest(
+                    top, stat.items(), key=lambda item: item[1])]
+
+
+def get_total(stat):
+    """
+    Возвращает число значений, учтённых счётчиком
+    """
+    if isinstance(stat, SpaceSaving):
+        return stat.total
+    return sum(stat.values())
+
+
+class SpaceSaving:
+    """
+    Приближённый счётчик самых частых значений (алгоритм Space-Saving).
+    Хранит не более capacity значений. Частота каждого хранимого значения
+    завышена не более чем на его ошибку, а ошибка не превышает
+    total / capacity. Любое значение с частотой больше этой границы
+    гарантированно хранится.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total = 0
+        self._counters = dict()
+        self._heap = list()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, count: int = 1, error: int = 0):
+        """
+        Учитывает count появлений значения key. error — ошибка,
+        уже накопленная для этого значения (при объединении счётчиков)
+        """
+        self.total += count
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += count
+            counter[1] += error
+        elif len(self._counters) < self.capacity:
+            self._counters[key] = [count, error]
+            heapq.heappush(self._heap, (count, key))
+        else:
+            minimum = self._pop_minimum()
+            self._counters[key] = [minimum + count, minimum + error]
+            heapq.heappush(self._heap, (minimum + count, key))
+
+    def update(self, stat: dict):
+        """
+        Учитывает частоты из словаря stat
+        """
+        for key, count in stat.items():
+            self.add(key, count)
+
+    def merge(self, other):
+        """
+        Добавляет к счётчику значения другого счётчика SpaceSaving
+        """
+        for key, (count, error) in other._counters.items():
+            self.add(key, count, error)
+
+    def most_common(self, n: int):
+        """
+        Возвращает n самых частых значений в виде списка троек
+        (значение, оценка частоты, ошибка оценки)
+        """
+        return [
+                (key, count, error)
+                for key, (count, error) in heapq.nlargest(
+                        n, self._counters.items(),
+                        key=lambda item: item[1][0])]
+
+    def _pop_minimum(self):
+        """
+        Удаляет значение с наименьшей частотой и возвращает эту частоту.
+        Частоты в куче могут быть устаревшими (только заниженными),
+        такие записи обновляются по мере извлечения.
+        """
+        heap = self._heap
+        while True:
+            count, key = heap[0]
+            actual = self._counters[key][0]
+            if actual == count:
+                break
+            heapq.heapreplace(heap, (actual, key))
+        heapq.heappop(heap)
+        del self._counters[key]
+        return count
+
+
+def as_path_list(file_path):
+    """
+    Возвращает список путей по пути до файла или списку путей
+    """
+    if isinstance(file_path, (str, os.PathLike)):
+        return [file_path]
+    return list(file_path)
+
+
+def get_opener(file_path: str):
+    """
+    Возвращает функцию для потокового чтения сжатого файла,
+    определяя формат по сигнатуре. Для несжатого файла возвращает None.
+    """
+    with open(file_path, 'rb') as file:
+        signature = file.read(8)
+    for magic, opener in COMPRESSED_FORMATS:
+        if signature.startswith(magic):
+            return opener
+    return None
+
+
+def iter_chunks(file_path: str, start: int = 0, end: int = None):
+    """
+    Возвращает итератор на блоки байт файла с позиции start до позиции end
+    (по умолчанию до конца файла). Файл читается блоками по CHUNK_SIZE,
+    каждый отдаваемый блок заканчивается на границе строки, так что
+    в памяти одновременно находится не больше двух блоков. Сжатый файл
+    распаковывается на лету, а позиции отсчитываются в распакованных
+    данных.
+    """
+    opener = get_opener(file_path)
+    with (open if opener is None else opener)(file_path, 'rb') as file:
+        yield from iter_stream_chunks(file, start, end)
+
+
+def iter_stream_chunks(file, start: int = 0, end: int = None):
+    """
+    Возвращает итератор на блоки байт из потока file с позиции start
+    до позиции end, заканчивающиеся на границе строки
+    """
+    if start:
+        file.seek(start)
+    remainder = b''
+    while end is None or start < end:
+        size = CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - start)
+        block = file.read(size)
+        if not block:
+            break
+        start += len(block)
+        block = remainder + block
+        stop = block.rfind(b'\n') + 1
+        if stop:
+            remainder = block[stop:]
+            yield block[:stop]
+        else:
+            remainder = block
+    if remainder:
+        yield remainder
+
+
+def count_columns_values(
+        file_path: str, column_numbers, start: int = 0, end: int = None,
+        capacity: int = 0, parser: str = DEFAULT_PARSER):
+    """
+    Возвращает список словарей частот значений столбцов column_numbers
+    в строках лога между позициями start и end. Строки разбираются
+    без декодирования разборщиком parser из LINE_PARSERS, ключами словарей
+    являются байты.
+    При capacity > 0 вместо словарей возвращаются объекты SpaceSaving:
+    частоты точно считаются в пределах блока файла и затем переносятся
+    в SpaceSaving, так что память ограничена размером блока и capacity.
+    """
+    stats = [dict() for _ in column_numbers]
+    summaries = [SpaceSaving(capacity) for _ in column_numbers]
+    parse = LINE_PARSERS[parser](column_numbers)
+    for chunk in iter_chunks(file_path, start, end):
+        for values in map(parse, split_lines(chunk)):
+            if values is not None:
+                for stat, key in zip(stats, values):
+                    stat[key] = stat.get(key, 0) + 1
+        if capacity:
+            for summary, stat in zip(summaries, stats):
+                summary.update(stat)
+                stat.clear()
+    return summaries if capacity else stats
+
+
+def count_column_values(
+        file_path: str, column_number: int, start: int = 0, end: int = None):
+    """
+    Возвращает словарь частот значений столбца column_number в строках лога
+    между позициями start и end. Ключами словаря являются байты.
+    """
+    return count_columns_values(file_path, (column_number,), start, end)[0]
+
+
+def split_lines(chunk: bytes):
+    """
+    Возвращает список строк блока. Как и при чтении файла в текстовом
+    режиме, строки разделяются символами '\\n', '\\r\\n' и '\\r'.
+    """
+    if b'\r' in chunk:
+        chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return chunk.split(b'\n')
+
+
+def make_split_parser(column_numbers):
+    """
+    Возвращает функцию, которая по строке лога возвращает список значений
+    столбцов column_numbers либо None, если в строке не COLUMNS_COUNT
+    непустых столбцов. Строка целиком делится по запятым, поля очищаются
+    от пробельных символов, пустые поля отбрасываются.
+    """
+    column_numbers = tuple(column_numbers)
+
+    def parse(line: bytes):
+        columns = line.split(b',')
+        if len(columns) < COLUMNS_COUNT:
+            return None
+        columns = [field.strip(_WHITESPACE) for field in columns]
+        if b'' in columns:
+            columns = [column for column in columns if column]
+        if len(columns) != COLUMNS_COUNT:
+            return None
+        return [columns[number] for number in column_numbers]
+
+    return parse
+
+
+def make_projection_parser(column_numbers):
+    """
+    Возвращает функцию с тем же поведением, что и у make_split_parser,
+    но выделяющую только нужные столбцы. Пустые поля ищутся в копии строки
+    без пробельных символов, и если их нет (кроме завершающего поля после
+    последней запятой), строка делится только до нужных столбцов — с начала
+    или с конца. Остальные строки разбираются как в make_split_parser.
+    """
+    indexes = [number % COLUMNS_COUNT for number in column_numbers]
+    first, last = min(indexes), max(indexes)
+    half = COLUMNS_COUNT // 2
+    if last < half:
+        split_count, tail_offset = last + 1, None
+    elif first >= half:
+        split_count, tail_offset = None, first - 1
+    else:
+        split_count, tail_offset = -1, None
+    if tail_offset is not None:
+        indexes = [index - tail_offset for index in indexes]
+    index = indexes[0] if len(indexes) == 1 else None
+    select = operator.itemgetter(*indexes)
+    fallback = make_split_parser(column_numbers)
+
+    minimum, maximum = COLUMNS_COUNT - 1, COLUMNS_COUNT
+    whitespace, strip_args = _WHITESPACE, _STRIP_ARGS
+
+    def parse(line: bytes):
+        commas = line.count(b',')
+        if commas < minimum:
+            return None
+        if commas <= maximum:
+            compact = line.translate(None, whitespace)
+            if (b',,' not in compact and not compact.startswith(b',')
+                    and compact.endswith(b',') == (commas == maximum)):
+                if split_count is None:
+                    fields = line.rsplit(b',', commas - tail_offset)
+                else:
+                    fields = line.split(b',', split_count)
+                if index is not None:
+                    return [fields[index].strip(whitespace)]
+                return list(map(bytes.strip, select(fields), strip_args))
+        return fallback(line)
+
+    return parse
+
+
+LINE_PARSERS = {
+        'split': make_split_parser,
+        'projection': make_projection_parser}
+
+
+def count_buckets(
+        file_path: str, column_numbers, bucket: int, capacity: int):
+    """
+    Возвращает словарь {начало интервала: [число строк, список SpaceSaving
+    по столбцам column_numbers]} для интервалов длиной bucket секунд.
+    Время строки берётся из столбцов DATE_COLUMN и TIME_COLUMN; частоты
+    в пределах блока файла считаются точно и затем переносятся в SpaceSaving.
+    """
+    buckets = dict()
+    days = dict()
+    parse = LINE_PARSERS[DEFAULT_PARSER](
+            (DATE_COLUMN, TIME_COLUMN) + tuple(column_numbers))
+    for chunk in iter_chunks(file_path):
+        chunk_buckets = dict()
+        for values in map(parse, split_lines(chunk)):
+            if values is None:
+                continue
+            timestamp = parse_timestamp(values[0], values[1], days)
+            if timestamp is None:
+                continue
+            start = timestamp - timestamp % bucket
+            counters = chunk_buckets.get(start)
+            if counters is None:
+                counters = chunk_buckets[start] = [
+                        [0], [dict() for _ in column_numbers]]
+            counters[0][0] += 1
+            for stat, key in zip(counters[1], values[2:]):
+                stat[key] = stat.get(key, 0) + 1
+        for start, ([lines], stats) in chunk_buckets.items():
+            if start not in buckets:
+                buckets[start] = [
+                        0, [SpaceSaving(capacity) for _ in column_numbers]]
+            buckets[start][0] += lines
+            for summary, stat in zip(buckets[start][1], stats):
+                summary.update(stat)
+    return buckets
+
+
+def parse_timestamp(date: bytes, time_of_day: bytes, days: dict):
+    """
+    Возвращает число секунд с начала эпохи для даты вида 'ММ/ДД/ГГ'
+    (или 'ММ/ДД/ГГГГ') и времени вида 'чч:мм:сс'. Начала дней кешируются
+    в словаре days. Если дата или время некорректны, возвращает None.
+    """
+    day = days.get(date)
+    if day is None:
+        try:
+            month, day_of_month, year = map(int, date.split(b'/'))
+            if year < 100:
+                year += 1900 if year >= 69 else 2000
+            day = (datetime.date(year, month, day_of_month).toordinal()
+                   - _EPOCH_ORDINAL) * 86400
+        except ValueError:
+            day = -1
+        days[date] = day
+    if day == -1:
+        return None
+    try:
+        hours, minutes, seconds = map(int, time_of_day.split(b':'))
+    except ValueError:
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 62):
+        return None
+    return day + hours * 3600 + minutes * 60 + seconds
+
+
+def get_index_path(file_path: str):
+    """
+    Возвращает путь до индекса, построенного для файла лога
+    """
+    return file_path + INDEX_SUFFIX
+
+
+def build_index(file_path: str, column_numbers):
+    """
+    Строит рядом с логом индекс по столбцам column_numbers и возвращает
+    путь до него. Индекс начинается с INDEX_MAGIC, длины заголовка (4 байта)
+    и заголовка в JSON с размером и временем изменения лога. Далее для
+    каждого столбца идут массивы: номера значений по убыванию частоты,
+    частоты, смещения значений в таблице строк, сама таблица строк
+    и номера значений по строкам лога (словарное кодирование столбца).
+    Номера значений присваиваются в порядке первого появления.
+    """
+    column_numbers = sorted(
+            {number % COLUMNS_COUNT for number in column_numbers})
+    info = os.stat(file_path)
+    tables = [dict() for _ in column_numbers]
+    counts = [array('Q') for _ in column_numbers]
+    ids_files = [tempfile.TemporaryFile() for _ in column_numbers]
+    rows = 0
+    parse = LINE_PARSERS[DEFAULT_PARSER](column_numbers)
+    try:
+        for chunk in iter_chunks(file_path):
+            ids = [array('I') for _ in column_numbers]
+            for values in map(parse, split_lines(chunk)):
+                if values is None:
+                    continue
+                rows += 1
+                for key, table, count, row_ids in zip(
+                        values, tables, counts, ids):
+                    value_id = table.get(key)
+                    if value_id is None:
+                        value_id = table[key] = len(table)
+                        count.append(0)
+                    count[value_id] += 1
+                    row_ids.append(value_id)
+            for row_ids, ids_file in zip(ids, ids_files):
+                row_ids.tofile(ids_file)
+        return write_index(
+                file_path, info, rows, column_numbers, tables, counts,
+                ids_files)
+    finally:
+        for ids_file in ids_files:
+            ids_file.close()
+
+
+def write_index(
+        file_path: str, info, rows: int, column_numbers, tables, counts,
+        ids_files):
+    """
+    Записывает индекс, собранный build_index, и возвращает путь до него
+    """
+    sections = list()
+    position = 0
+    for column_number, table, count in zip(column_numbers, tables, counts):
+        offsets = array('Q', [0])
+        offsets.extend(itertools.accumulate(map(len, table)))
+        section = {'column': column_number, 'values': len(table)}
+        for name, size in (
+                ('order', len(table) * 4),
+                ('counts', len(table) * 8),
+                ('offsets', len(offsets) * 8),
+                ('pool', offsets[-1]),
+                ('ids', rows * 4)):
+            section[name] = position
+            position += size
+        sections.append((section, offsets))
+    header = json.dumps({
+            'size': info.st_size,
+            'mtime_ns': info.st_mtime_ns,
+            'byteorder': sys.byteorder,
+            'rows': rows,
+            'columns': [section for section, _ in sections]}).encode()
+    index_path = get_index_path(file_path)
+    temporary = index_path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(INDEX_MAGIC)
+        file.write(len(header).to_bytes(4, 'little'))
+        file.write(header)
+        for (section, offsets), table, count, ids_file in zip(
+                sections, tables, counts, ids_files):
+            array('I', sorted(
+                    range(len(count)), key=lambda i: -count[i])).tofile(file)
+            count.tofile(file)
+            offsets.tofile(file)
+            file.write(b''.join(table))
+            ids_file.seek(0)
+            shutil.copyfileobj(ids_file, file)
+    os.replace(temporary, index_path)
+    return index_path
+
+
+def read_index_header(index_path: str, file_path: str):
+    """
+    Возвращает заголовок индекса и позицию начала его данных.
+    Если индекса нет, он построен для другой версии лога или повреждён
+    (в том числе обрезан), возвращает (None, 0).
+    """
+    try:
+        file = open(index_path, 'rb')
+    except FileNotFoundError:
+        return None, 0
+    except OSError as e:
+        print(
+                'Не удалось прочитать индекс {}: {}'.format(index_path, e),
+                file=sys.stderr)
+        return None, 0
+    try:
+        with file:
+            if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None, 0
+            length = int.from_bytes(file.read(4), 'little')
+            header = json.loads(file.read(length))
+            data_start = file.tell()
+            data_size = os.fstat(file.fileno()).st_size - data_start
+        size, mtime_ns = header['size'], header['mtime_ns']
+        byteorder = header['byteorder']
+        data_end = max((
+                section['ids'] + header['rows'] * 4
+                for section in header['columns']), default=0)
+        if data_size < data_end:
+            raise EOFError('index is truncated')
+    except (ValueError, KeyError, TypeError, EOFError, OSError) as e:
+        print(
+                'Индекс {} повреждён и не используется: {}'.format(
+                        index_path, e),
+                file=sys.stderr)
+        return None, 0
+    info = os.stat(file_path)
+    if (size != info.st_size
+            or mtime_ns != info.st_mtime_ns
+            or byteorder != sys.byteorder):
+        print(
+                'Индекс {} устарел и не используется'.format(index_path),
+                file=sys.stderr)
+        return None, 0
+    return header, data_start
+
+
+def query_index(file_path: str, column_numbers, top: int):
+    """
+    Возвращает число учтённых строк лога и для каждого столбца
+    из column_numbers список top пар (значение, частота), прочитанные
+    из индекса лога. Читаются только нужные элементы массивов.
+    Если подходящего индекса нет, возвращает None.
+    """
+    index_path = get_index_path(file_path)
+    header, data_start = read_index_header(index_path, file_path)
+    if header is None:
+        return None
+    sections = {section['column']: section for section in header['columns']}
+    if any(number % COLUMNS_COUNT not in sections
+           for number in column_numbers):
+        return None
+
+    def read_array(typecode, position, count):
+        file.seek(data_start + position)
+        result = array(typecode)
+        result.frombytes(file.read(count * result.itemsize))
+        return result
+
+    tops = list()
+    with open(index_path, 'rb') as file:
+        for number in column_numbers:
+            section = sections[number % COLUMNS_COUNT]
+            order = read_array(
+                    'I', section['order'], min(top, section['values']))
+            column_top = list()
+            for value_id in order:
+                count = read_array('Q', section['counts'] + value_id * 8, 1)
+                start, end = read_array(
+                        'Q', section['offsets'] + value_id * 8, 2)
+                file.seek(data_start + section['pool'] + start)
+                column_top.append((file.read(end - start), count[0]))
+            tops.append(column_top)
+    return header['rows'], tops
+
+
+def query_index_if_possible(
+        file_path, column_numbers, top: int, capacity: int = 0,
+        checkpoint: str = None):
+    """
+    Отвечает на запрос по индексу (см. query_index), если запрос касается
+    одного файла лога и точного подсчёта без контрольной точки.
+    Иначе, или если подходящего индекса нет, возвращает None.
+    """
+    file_paths = as_path_list(file_path)
+    if capacity or checkpoint is not None or len(file_paths) != 1:
+        return None
+    return query_index(file_paths[0], column_numbers, top)
+
+
+def count_column_values_by_lines(file_path: str, column_number: int):
+    """
+    Возвращает словарь частот значений столбца column_number, читая лог
+    построчно через read_lines. Эталонная реализация для сравнения
+    с count_column_values.
     """
     stat = dict()
-    buffer_size = 10 * 1024 * 1024
+    buffer_size = CHUNK_SIZE
     lines, start_byte = read_lines(file_path, 0, buffer_size)
     while lines is not None:
         for line in lines:
@@ -120,13 +1185,13 @@ def get_max_of_column_from_file(file_path: str, column_number: int):
                     filter(
                             lambda l: len(l) > 0,
                             map(lambda l: l.strip(), line.split(','))))
-            if len(columns) == 15:
+            if len(columns) == COLUMNS_COUNT:
                 try:
                     stat[columns[column_number]] += 1
                 except KeyError:
                     stat[columns[column_number]] = 1
         lines, start_byte = read_lines(file_path, start_byte, buffer_size)
-    return max(stat, key=lambda k: stat[k]) if stat else None
+    return stat
 
 
 def get_help():
@@ -140,12 +1205,50 @@ def get_help():
     python {0} [path_to_log_file] help
        Помощь по использованию утилиты
        Если лог указан, он игнорируется
+
+    Вместо одного пути path_to_log_file можно указать несколько путей
+    или шаблонов вида 'access.log*': статистика считается по всем файлам
+    вместе. Файлы, сжатые gzip, bzip2 или xz, распаковываются на лету.
     
-    python {0} path_to_log_file popular_resource
+    python {0} path_to_log_file popular_resource [параметры]
         Выдать самый популярный ресурс
         
-    python {0} path_to_log_file popular_user
+    python {0} path_to_log_file popular_user [параметры]
         Выдать самого активного клиента
+
+    python {0} path_to_log_file buckets [--bucket S] [параметры]
+        За один проход разбить лог на интервалы по S секунд (по умолчанию
+        3600) и выдать в формате JSON top самых частых значений столбцов
+        для каждого интервала. Подсчёт приближённый, в каждом интервале
+        хранится не более --capacity (по умолчанию 10 * --top) значений
+
+    python {0} path_to_log_file build-index [--columns 0,-2]
+        Построить рядом с логом индекс path_to_log_file.idx по столбцам.
+        Пока лог не изменится, popular_resource, popular_user
+        и statistics по этим столбцам отвечают по индексу, не читая лог
+
+    python {0} path_to_log_file statistics [параметры]
+        За один проход выдать в формате JSON top самых частых значений
+        каждого из столбцов (клиент — 0, ресурс — -2) и их количество
+
+    Параметры:
+    --workers N
+        Обработать лог в N процессах (0 — по числу ядер), по умолчанию 1
+    --columns C1,C2,...
+        Номера столбцов для statistics, по умолчанию 0,-2
+    --top N
+        Число значений каждого столбца для statistics, по умолчанию 10
+    --capacity N
+        Считать приближённо, храня не более N значений каждого столбца
+        (алгоритм Space-Saving). Для statistics у каждого значения
+        выдаётся 'error' — на сколько 'count' может быть завышен.
+        По умолчанию 0 — точный подсчёт
+    --checkpoint FILE
+        Хранить в FILE позицию, до которой обработан лог, и счётчики.
+        Следующий запуск с тем же FILE обработает только дописанные
+        в лог строки; при ротации или усечении лог обрабатывается заново
+    --bucket S
+        Длина интервала времени для buckets в секундах
     """.format(sys.argv[0])
 
 
@@ -157,11 +1260,27 @@ def print_result_of_work(result: str):
 
 
 def main():
-    file_path, mode = get_arguments()
+    file_paths, mode, options = get_arguments()
     if mode is MODES.POPULAR_RESOURCE:
-        print_result_of_work(find_most_popular_resource(file_path))
+        print_result_of_work(find_most_popular_resource(
+                file_paths, options['workers'], options['capacity'],
+                options['checkpoint']))
     elif mode is MODES.POPULAR_USER:
-        print_result_of_work(find_most_active_user(file_path))
+        print_result_of_work(find_most_active_user(
+                file_paths, options['workers'], options['capacity'],
+                options['checkpoint']))
+    elif mode is MODES.STATISTICS:
+        print_result_of_work(json.dumps(get_statistics(
+                file_paths, options['columns'], options['top'],
+                options['workers'], options['capacity'],
+                options['checkpoint']), ensure_ascii=False))
+    elif mode is MODES.BUCKETS:
+        print_result_of_work(json.dumps(get_bucket_statistics(
+                file_paths, options['columns'], options['bucket'],
+                options['top'], options['capacity']), ensure_ascii=False))
+    elif mode is MODES.BUILD_INDEX:
+        for file_path in file_paths:
+            print_result_of_work(build_index(file_path, options['columns']))
     else:
         print_result_of_work(get_help())
 
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import itertools
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from merge import fast_log_key, log_key, merge
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+START = datetime(2004, 3, 1)
+LINE_FORMAT = '{} - - [{:%d/%b/%Y:%H:%M:%S} +0000] "GET /{} HTTP/1.1" 200\n'
+
+# Способы слияния: функция (потоки, ключ) -> итератор на результат
+IMPLEMENTATIONS = {
+        'merge': lambda streams, key: merge(*streams, key=key),
+        'heapq': lambda streams, key: heapq.merge(*streams, key=key),
+        'sorted': lambda streams, key: iter(
+                sorted(itertools.chain(*streams), key=key))}
+KEYS = {
+        'fast_log_key': fast_log_key,
+        'log_key': log_key}
+
+
+def rss_growth(function, *args):
+    """
+    Вызывает function(*args) и возвращает пару: её результат и прирост
+    пиковой резидентной памяти процесса за время вызова в мегабайтах
+    (None, если модуля resource нет). Пик процесса не уменьшается,
+    поэтому прирост виден, только пока процесс не занимал больше памяти
+    """
+    if resource is None:
+        return function(*args), None
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = function(*args)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result, (after - before) / scale
+
+
+def get_lengths(streams: int, items: int, skew: float):
+    """
+    Возвращает длины streams потоков с суммой items, убывающие
+    по закону Ципфа с показателем skew (skew = 0 — равные длины)
+    """
+    weights = [1 / rank ** skew for rank in range(1, streams + 1)]
+    total = sum(weights)
+    lengths = [int(items * weight / total) for weight in weights]
+    lengths[0] += items - sum(lengths)
+    return lengths
+
+
+def make_streams(
+        kind: str, streams: int, items: int, skew: float,
+        duplicates: float, seed: int):
+    """
+    Возвращает список упорядоченных потоков: чисел ('ints') или строк лога
+    ('lines'). duplicates — доля элементов, равных предыдущему в потоке
+    """
+    rnd = random.Random(seed)
+    result = list()
+    for number, length in enumerate(get_lengths(streams, items, skew)):
+        values = list(itertools.accumulate(
+                0 if rnd.random() < duplicates else rnd.randint(1, streams)
+                for _ in range(length)))
+        if kind == 'lines':
+            values = [
+                    LINE_FORMAT.format(
+                            number, START + timedelta(seconds=value), i)
+                    for i, value in enumerate(values)]
+        result.append(values)
+    return result
+
+
+def run(implementation: str, kind: str, key: str, parameters: tuple):
+    """
+    Сливает сгенерированные потоки способом implementation и возвращает
+    число элементов, время до первого элемента и общее время в секундах
+    и прирост пиковой памяти в мегабайтах на время слияния
+    """
+    streams = make_streams(kind, *parameters)
+    key = KEYS[key] if kind == 'lines' else None
+
+    def consume():
+        start = time.perf_counter()
+        iterator = IMPLEMENTATIONS[implementation](streams, key)
+        first = None
+        count = 0
+        for _ in iterator:
+            first = time.perf_counter() - start
+            count = 1
+            break
+        for _ in iterator:
+            count += 1
+        return count, first, time.perf_counter() - start
+
+    (count, first, seconds), memory = rss_growth(consume)
+    return count, first, seconds, memory
+
+
+def measure(*args):
+    """
+    Возвращает результат run, выполненного в новом процессе: слияния,
+    запущенные раньше в том же процессе, подняли бы пик, от которого
+    считается прирост (см. rss_growth)
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run, *args).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark of merge.py against heapq.merge and sorted')
+    parser.add_argument(
+            '--kinds', default='ints,lines',
+            help='comma separated kinds of items: ints, lines')
+    parser.add_argument(
+            '--streams', default='2,16,256',
+            help='comma separated numbers of streams')
+    parser.add_argument(
+            '--items', default='1000000',
+            help='comma separated total numbers of items')
+    parser.add_argument(
+            '--skew', default='0,1',
+            help='comma separated Zipf exponents of stream lengths')
+    parser.add_argument(
+            '--duplicates', default='0,0.5',
+            help='comma separated shares of repeated items')
+    parser.add_argument(
+            '--implementations', default=','.join(IMPLEMENTATIONS),
+            help='comma separated implementations: ' +
+            ', '.join(IMPLEMENTATIONS))
+    parser.add_argument(
+            '--key', default='fast_log_key', choices=KEYS,
+            help='key for log lines')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    implementations = args.implementations.split(',')
+    kinds = args.kinds.split(',')
+    for name in implementations:
+        if name not in IMPLEMENTATIONS:
+            parser.error('unknown implementation {}'.format(name))
+    for name in kinds:
+        if name not in ('ints', 'lines'):
+            parser.error('unknown kind {}'.format(name))
+
+    row = '{:>6} {:>7} {:>9} {:>5} {:>5} {:>7} {:>8} {:>10} {:>10} {:>8}'
+    print(row.format(
+            'kind', 'streams', 'items', 'skew', 'dups', 'impl', 'seconds',
+            'items/s', 'first ms', 'extra MB'))
+    for kind, streams, items, skew, duplicates in itertools.product(
+            kinds, map(int, args.streams.split(',')),
+            map(int, args.items.split(',')),
+            map(float, args.skew.split(',')),
+            map(float, args.duplicates.split(','))):
+        parameters = streams, items, skew, duplicates, args.seed
+        for implementation in implementations:
+            count, first, seconds, memory = measure(
+                    implementation, kind, args.key, parameters)
+            print(row.format(
+                    kind, streams, count, skew, duplicates, implementation,
+                    '{:.2f}'.format(seconds),
+                    '{:.0f}'.format(count / seconds if seconds else 0),
+                    '-' if first is None else '{:.2f}'.format(first * 1000),
+                    '-' if memory is None else '{:.0f}'.format(memory)),
+                    flush=True)
+
+
+if __name__ == '__main__':
+    main()
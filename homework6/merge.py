@@ -1,12 +1,34 @@
 #!/usr/bin/env python3
 
+import heapq
+import itertools
+import os
+import pickle
+import queue
+import random
+import sys
+import tempfile
+import threading
 import unittest
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 
 REGEX = re.compile(
         r'\[(\d{1,2})/([a-zA-Z]+?)/(\d{4}):(\d{1,2}):(\d{1,2}):(\d{1,2}).*?]',
         re.DOTALL)
+MONTHS = {
+        name: number for number, name in enumerate((
+                'jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+SORT_MEMORY = 64 * 2 ** 20
+SORT_FAN_IN = 64
+READ_BATCH = 4096
+BUFFER_BATCHES = 4
+FAN_IN = 64
+POLL_INTERVAL = 0.1
+SEARCH_BLOCK = 8192
+_DONE = object()
 
 
 def merge(*iterables, key=None):
@@ -15,10 +37,274 @@ def merge(*iterables, key=None):
 
     Результат — итератор на упорядоченные данные.
     В случае равенства данных следует их упорядочить в порядке следования
-    коллекций"""
-    items = [item for iterable in iterables for item in iterable]
-    items.sort(key=key)
-    return iter(items)
+    коллекций.
+
+    Слияние потоковое: в памяти одновременно хранится не более одного
+    элемента из каждой коллекции, а ключ вычисляется по одному разу
+    для каждого элемента"""
+    heap = list()
+    for index, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            heap.append([
+                    item if key is None else key(item), index, item, iterator])
+            break
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        entry = heap[0]
+        yield entry[2]
+        for item in entry[3]:
+            entry[0] = item if key is None else key(item)
+            entry[2] = item
+            heapq.heapreplace(heap, entry)
+            break
+        else:
+            heapq.heappop(heap)
+    if heap:
+        yield heap[0][2]
+        yield from heap[0][3]
+
+
+def external_sort(
+        *iterables, key=None, max_memory=SORT_MEMORY, fan_in=SORT_FAN_IN):
+    """Функция сортирует по ключу `key` данные из `iterables`, не загружая
+    их в память целиком.
+
+    Данные читаются порциями примерно по `max_memory` байт, каждая порция
+    сортируется и сбрасывается во временный файл, после чего файлы
+    склеиваются функцией `merge`. Если файлов не меньше `fan_in`, они
+    склеиваются в несколько проходов группами по `fan_in` соседних файлов,
+    поэтому одновременно читается не больше `fan_in` файлов, а каждый
+    из них — порциями примерно по `max_memory / fan_in` байт. Результат —
+    итератор на те же данные и в том же порядке, что и у
+    sorted(itertools.chain(*iterables), key=key).
+    Элементы и ключи должны сериализоваться модулем pickle"""
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2')
+    directory = None
+    runs = list()
+    chunk = list()
+    size = 0
+    batch = 1
+    for item in itertools.chain(*iterables):
+        chunk.append((item if key is None else key(item), item))
+        size += sys.getsizeof(item)
+        if size >= max_memory:
+            if directory is None:
+                directory = tempfile.TemporaryDirectory()
+            batch = max(1, len(chunk) * max_memory // (size * fan_in))
+            chunk.sort(key=_first)
+            runs.append(_write_run(directory.name, chunk, batch))
+            chunk = list()
+            size = 0
+    chunk.sort(key=_first)
+    if not runs:
+        return (item for _, item in chunk)
+    while len(runs) >= fan_in:
+        runs = [
+                _write_run(
+                        directory.name,
+                        merge(*map(_read_run, runs[i:i + fan_in]), key=_first),
+                        batch)
+                for i in range(0, len(runs), fan_in)]
+    return _merge_runs(directory, list(map(_read_run, runs)) + [iter(chunk)])
+
+
+def _first(pair):
+    return pair[0]
+
+
+def _write_run(directory, pairs, batch):
+    """Записывает упорядоченные пары (ключ, элемент) во временный файл
+    в каталоге `directory` порциями по `batch` пар. Возвращает путь до
+    файла"""
+    descriptor, path = tempfile.mkstemp(dir=directory)
+    pairs = iter(pairs)
+    with open(descriptor, 'wb') as file:
+        while True:
+            part = list(itertools.islice(pairs, batch))
+            if not part:
+                return path
+            pickle.dump(part, file, pickle.HIGHEST_PROTOCOL)
+
+
+def _read_run(path):
+    """Возвращает итератор на пары из временного файла и удаляет его,
+    когда пары заканчиваются"""
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                break
+            yield from batch
+    os.remove(path)
+
+
+def _merge_runs(directory, runs):
+    """Склеивает итераторы на пары и возвращает итератор на элементы.
+    Временный каталог удаляется, когда элементы заканчиваются"""
+    with directory:
+        for _, item in merge(*runs, key=_first):
+            yield item
+
+
+def merge_files(
+        *paths, key=None, encoding='utf-8', batch_size=READ_BATCH,
+        buffer_batches=BUFFER_BATCHES, fan_in=FAN_IN):
+    """Функция склеивает упорядоченные по ключу `key` строки файлов
+    `paths` так же, как `merge` склеила бы открытые файлы.
+
+    Каждый файл читается и разбирается в отдельном фоновом потоке: строки
+    вместе с ключами передаются пачками по `batch_size` строк через очередь
+    не более чем из `buffer_batches` пачек, поэтому чтение с диска идёт
+    параллельно со слиянием, а память ограничена. Если файлов больше
+    `fan_in`, они сливаются деревом: соседние файлы группами по `fan_in`
+    склеиваются в своих потоках, а затем склеиваются результаты групп.
+    По умолчанию для каждого файла используется свой `make_fast_log_key()`.
+    Ошибка чтения или вычисления ключа пробрасывается из итератора, а при
+    его закрытии фоновые потоки завершаются"""
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2')
+    stop = threading.Event()
+
+    def start(batches):
+        buffer = queue.Queue(buffer_batches)
+        threading.Thread(
+                target=_produce, args=(batches, buffer, stop),
+                daemon=True).start()
+        return _consume(buffer, stop)
+
+    sources = [
+            start(_read_batches(
+                    path, make_fast_log_key() if key is None else key,
+                    encoding, batch_size))
+            for path in paths]
+    while len(sources) > fan_in:
+        sources = [
+                start(_merge_batches(sources[i:i + fan_in], batch_size))
+                for i in range(0, len(sources), fan_in)]
+    try:
+        for _, line in merge(*sources, key=_first):
+            yield line
+    finally:
+        stop.set()
+
+
+def _read_batches(path, key, encoding, batch_size):
+    """Возвращает итератор на пачки пар (ключ, строка) из файла"""
+    with open(path, encoding=encoding) as file:
+        while True:
+            lines = list(itertools.islice(file, batch_size))
+            if not lines:
+                return
+            yield list(zip(map(key, lines), lines))
+
+
+def _merge_batches(sources, batch_size):
+    """Возвращает итератор на пачки пар, склеенных из итераторов на пары"""
+    merged = merge(*sources, key=_first)
+    return iter(lambda: list(itertools.islice(merged, batch_size)), [])
+
+
+def _produce(batches, buffer, stop):
+    """Перекладывает пачки в очередь, пока не будет установлен `stop`.
+    В конце в очередь кладётся `_DONE` или возникшее исключение"""
+    try:
+        for batch in batches:
+            if not _put(buffer, batch, stop):
+                return
+    except BaseException as error:
+        _put(buffer, error, stop)
+    else:
+        _put(buffer, _DONE, stop)
+
+
+def _put(buffer, item, stop):
+    """Кладёт элемент в очередь, ожидая места в ней. Возвращает False,
+    если ожидание прервано установкой `stop`"""
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _consume(buffer, stop):
+    """Возвращает итератор на элементы пачек из очереди"""
+    while not stop.is_set():
+        try:
+            batch = buffer.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if batch is _DONE:
+            return
+        if isinstance(batch, BaseException):
+            raise batch
+        yield from batch
+
+
+def extract_range(
+        *paths, start=None, end=None, key=None, encoding='utf-8'):
+    """Функция возвращает итератор на строки упорядоченных по ключу `key`
+    файлов `paths`, ключ которых не меньше `start` и меньше `end`, в том же
+    порядке, в каком их вернула бы `merge`.
+
+    Начало диапазона в каждом файле ищется двоичным поиском по смещению
+    в байтах с выравниванием на начало строки, поэтому запрос стоит
+    O(log n) чтений и размера ответа. `start` или `end`, равные None,
+    не ограничивают диапазон. По умолчанию для каждого файла используется
+    свой `make_fast_log_key()`, и границы могут быть заданы как числом
+    секунд с начала эпохи, так и объектом datetime"""
+    if key is None:
+        if isinstance(start, datetime):
+            start = _to_seconds(start)
+        if isinstance(end, datetime):
+            end = _to_seconds(end)
+    slices = [
+            _read_range(
+                    path, start, end,
+                    make_fast_log_key() if key is None else key, encoding)
+            for path in paths]
+    return (line for _, line in merge(*slices, key=_first))
+
+
+def _read_range(path, start, end, key, encoding):
+    """Возвращает итератор на пары (ключ, строка) из диапазона ключей
+    упорядоченного файла"""
+    with open(path, 'rb') as file:
+        if start is not None:
+            file.seek(_find_start(file, start, key, encoding))
+        for raw in file:
+            line = raw.decode(encoding)
+            line_key = key(line)
+            if start is not None and line_key < start:
+                continue
+            if end is not None and not line_key < end:
+                return
+            yield line_key, line
+
+
+def _find_start(file, start, key, encoding):
+    """Возвращает смещение, начиная с которого в упорядоченном файле
+    не больше `SEARCH_BLOCK` байт строк с ключом меньше `start`.
+
+    Поддерживается условие: первая строка с ключом не меньше `start`
+    начинается не раньше `low` и не позже первого начала строки
+    не раньше `high`"""
+    low, high = 0, file.seek(0, 2)
+    while high - low > SEARCH_BLOCK:
+        middle = (low + high) // 2
+        file.seek(middle - 1)
+        file.readline()
+        line = file.readline()
+        if line and key(line.decode(encoding)) < start:
+            low = file.tell()
+        else:
+            high = middle
+    return low
 
 
 def log_key(s):
@@ -28,15 +314,91 @@ def log_key(s):
             '%d %b %Y %H %M %S')
 
 
+def make_fast_log_key(use_timezone=False):
+    """Функция возвращает функцию, которая по строке лога возвращает ключ
+    для её сравнения по времени — целое число секунд с начала эпохи.
+
+    Время вида `[dd/Mon/YYYY:HH:MM:SS ...]` разбирается по фиксированным
+    позициям, начало дня вычисляется один раз для подряд идущих строк
+    с одной датой. Строки в другом формате разбираются функцией `log_key`,
+    поэтому порядок строк по такому ключу совпадает с порядком по `log_key`.
+    Если `use_timezone`, из времени вычитается смещение вида `+0300`,
+    указанное после него, и строки сравниваются по времени UTC"""
+    last_date = [(None, 0)]
+
+    def fast_log_key(s):
+        i = s.find('[')
+        if i != -1 and s[i + 3:i + 4] == '/' and s[i + 7:i + 8] == '/' and \
+                s[i + 12:i + 13] == ':' and s[i + 15:i + 16] == ':' and \
+                s[i + 18:i + 19] == ':' and s.find(']', i + 21) != -1:
+            date = s[i + 1:i + 12]
+            cached_date, day = last_date[0]
+            if date != cached_date:
+                day = _parse_day(date)
+                if day is not None:
+                    last_date[0] = date, day
+            clock = s[i + 13:i + 15] + s[i + 16:i + 18] + s[i + 19:i + 21]
+            if day is not None and clock.isascii() and clock.isdecimal():
+                hours, minutes = int(clock[:2]), int(clock[2:4])
+                seconds = int(clock[4:])
+                if hours < 24 and minutes < 60 and seconds < 60:
+                    key = day + hours * 3600 + minutes * 60 + seconds
+                    if use_timezone:
+                        key -= _parse_offset(s[i + 21:i + 27])
+                    return key
+        key = _to_seconds(log_key(s))
+        if use_timezone:
+            end = REGEX.search(s).end(6)
+            key -= _parse_offset(s[end:end + 6])
+        return key
+
+    return fast_log_key
+
+
+def _to_seconds(moment):
+    """Функция переводит момент времени в число секунд с начала эпохи"""
+    return (moment.toordinal() - EPOCH_ORDINAL) * 86400 + \
+        moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def _parse_day(date):
+    """Функция по дате вида `dd/Mon/YYYY` возвращает число секунд от начала
+    эпохи до начала этого дня или None, если дата некорректна"""
+    digits = date[:2] + date[7:]
+    month = MONTHS.get(date[3:6].lower())
+    if month is None or not (digits.isascii() and digits.isdecimal()):
+        return None
+    try:
+        ordinal = datetime(int(date[7:]), month, int(date[:2])).toordinal()
+    except ValueError:
+        return None
+    return (ordinal - EPOCH_ORDINAL) * 86400
+
+
+def _parse_offset(zone):
+    """Функция по смещению часового пояса вида ` +0300` возвращает его
+    в секундах (0, если смещение не указано)"""
+    digits = zone[2:]
+    if zone[:1] != ' ' or zone[1:2] not in ('+', '-') or \
+            len(digits) != 4 or not (digits.isascii() and digits.isdecimal()):
+        return 0
+    offset = int(digits[:2]) * 3600 + int(digits[2:]) * 60
+    return -offset if zone[1] == '-' else offset
+
+
+fast_log_key = make_fast_log_key()
+
+
 class TestTest(unittest.TestCase):
     def setUp(self):
         several_iterables = list()
-        several_iterables.append(([1, 2], [[2, 1], []]))
-        several_iterables.append(([1, 2, 3, 4], [[2, 1], [3, 4]]))
-        several_iterables.append(([1, 1, 1, 2], [[2, 1], [1, 1]]))
-        several_iterables.append(([1, 2, 3, 4, 5], [[2, 1], [3, 5, 4]]))
+        several_iterables.append(([1, 2], [[1, 2], []]))
+        several_iterables.append(([1, 2, 3, 4], [[1, 2], [3, 4]]))
+        several_iterables.append(([1, 1, 1, 2], [[1, 2], [1, 1]]))
+        several_iterables.append(([1, 2, 3, 4, 5], [[1, 2], [3, 4, 5]]))
+        several_iterables.append(([1, 2, 3, 4, 5], [[2, 4], [1, 3, 5]]))
         several_iterables.append(
-                ([1, 1, 2, 3, 4, 5, 6, 7], [[2, 1, 1], [3, ], [4, 5, 6, 7]]))
+                ([1, 1, 2, 3, 4, 5, 6, 7], [[1, 1, 2], [3, ], [4, 5, 6, 7]]))
         self.several_iterables = several_iterables
 
     def _check(self, expected: iter, actual: iter):
@@ -46,7 +408,7 @@ class TestTest(unittest.TestCase):
         self._check(iter([]), [])
 
     def test_one_not_empty_iterable(self):
-        self._check(iter([1, 2, 3]), merge([3, 1, 2]))
+        self._check(iter([1, 2, 3]), merge([1, 2, 3]))
 
     def test_several_iterables(self):
         for expected, actual in self.several_iterables:
@@ -54,4 +416,180 @@ class TestTest(unittest.TestCase):
                 self._check(iter(expected), merge(*actual))
 
     def test_using_key(self):
-        self._check(iter([4, 3, 2, 1]), merge([1, 2, 4, 3], key=lambda x: -x))
+        self._check(
+                iter([4, 3, 2, 1]), merge([4, 2], [3, 1], key=lambda x: -x))
+
+    def test_equal_items_keep_order_of_iterables(self):
+        self._check(
+                iter(['a1', 'b1', 'c1', 'a2', 'c2', 'b3']),
+                merge(['a1', 'a2'], ['b1', 'b3'], ['c1', 'c2'],
+                      key=lambda s: int(s[1])))
+
+    def test_key_is_computed_once_per_item(self):
+        calls = list()
+
+        def key(x):
+            calls.append(x)
+            return x
+
+        self._check(iter([1, 2, 3, 4, 5]), merge([1, 4], [2, 3, 5], key=key))
+        self.assertListEqual(sorted(calls), [1, 2, 3, 4, 5])
+
+    def test_external_sort_matches_sorted(self):
+        rnd = random.Random(0)
+        iterables = [
+                [rnd.randint(0, 50) for _ in range(rnd.randint(0, 300))]
+                for _ in range(4)]
+        for max_memory in (1, 500, 2000, SORT_MEMORY):
+            with self.subTest(max_memory=max_memory):
+                self._check(
+                        sorted(itertools.chain(*iterables), key=lambda x: -x),
+                        external_sort(
+                                *iterables, key=lambda x: -x,
+                                max_memory=max_memory))
+
+    def test_external_sort_with_many_runs(self):
+        rnd = random.Random(4)
+        items = [rnd.random() for _ in range(3000)]
+        expected = sorted(items)
+        for fan_in in (2, 3, 64):
+            with self.subTest(fan_in=fan_in):
+                self._check(expected, external_sort(
+                        items, max_memory=500, fan_in=fan_in))
+        pairs = [(rnd.randint(0, 20), i) for i in range(500)]
+        self._check(
+                sorted(pairs, key=_first),
+                external_sort(pairs, key=_first, max_memory=100, fan_in=2))
+        with self.assertRaises(ValueError):
+            external_sort(items, fan_in=1)
+
+    def test_external_sort_is_stable(self):
+        lines = [
+                '{} [{:02}/Mar/2004:13:0{}:00 -0800] "GET"'.format(i, d, m)
+                for i, (d, m) in enumerate(itertools.product(
+                        (3, 1, 2), (5, 1, 1, 3)))]
+        self._check(
+                sorted(lines, key=log_key),
+                external_sort(lines, key=log_key, max_memory=300))
+
+    def test_fast_log_key_gives_same_order(self):
+        rnd = random.Random(1)
+        lines = [
+                'a [3/Mar/2004:13:05:00 -0800] "GET"',
+                'b [x] [03/mar/2004:13:05:00] "GET"',
+                'c [01/Jan/2004:00:00:00 +0000] [02/Jan/2004:00:00:00]',
+                'd [29/Feb/2004:23:59:59 +0100]']
+        template = '{} [{:02}/{}/{}:{:02}:{:02}:{:02} +0300] "GET"'
+        for i in range(2000):
+            lines.append(template.format(
+                    i, rnd.randint(1, 28), rnd.choice(['Jan', 'Feb', 'Mar']),
+                    rnd.choice([2003, 2004]), rnd.randint(0, 23),
+                    rnd.randint(0, 59), rnd.randint(0, 59)))
+        self._check(
+                sorted(lines, key=log_key), sorted(lines, key=fast_log_key))
+        self.assertEqual(fast_log_key(lines[0]), fast_log_key(lines[1]))
+
+    def test_fast_log_key_errors_and_timezone(self):
+        for line in (
+                'no time', '[31/Feb/2004:00:00:00]', '[01/Foo/2004:0:0:0]'):
+            with self.subTest(line=line):
+                with self.assertRaises((IndexError, ValueError)):
+                    log_key(line)
+                with self.assertRaises((IndexError, ValueError)):
+                    fast_log_key(line)
+        utc_key = make_fast_log_key(use_timezone=True)
+        self.assertEqual(
+                utc_key('[01/Jan/2004:03:00:00 +0300]'),
+                utc_key('[31/Dec/2003:23:30:00 -0030]'))
+        self.assertEqual(
+                utc_key('[3/Mar/2004:13:05:00 +0300]'),
+                utc_key('[03/Mar/2004:13:05:00 +0300]'))
+        self.assertEqual(
+                utc_key('[3/Mar/2004:13:05:00]'),
+                utc_key('[03/Mar/2004:13:05:00]'))
+        self.assertEqual(
+                fast_log_key('[01/Jan/1970:00:01:00 +0300]'), 60)
+
+    def test_merge_is_lazy(self):
+        merged = merge(itertools.count(0, 2), itertools.count(1, 2))
+        self.assertListEqual(
+                list(itertools.islice(merged, 5)), [0, 1, 2, 3, 4])
+
+    def _write_logs(self, directory, logs):
+        paths = list()
+        for number, lines in enumerate(logs):
+            path = os.path.join(directory, '{}.log'.format(number))
+            with open(path, 'w') as file:
+                file.writelines(lines)
+            paths.append(path)
+        return paths
+
+    def test_merge_files_matches_stable_sort(self):
+        rnd = random.Random(2)
+        template = '{} {} [01/Mar/2004:13:{:02}:{:02} -0800] "GET"\n'
+        logs = [
+                sorted((template.format(
+                        number, i, rnd.randint(0, 5), rnd.randint(0, 59))
+                        for i in range(rnd.randint(0, 200))), key=log_key)
+                for number in range(7)]
+        expected = sorted(itertools.chain(*logs), key=log_key)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self._write_logs(directory, logs)
+            for fan_in, batch_size in ((64, 4096), (2, 3), (3, 1)):
+                with self.subTest(fan_in=fan_in, batch_size=batch_size):
+                    self._check(expected, merge_files(
+                            *paths, fan_in=fan_in, batch_size=batch_size,
+                            buffer_batches=1))
+
+    def test_merge_files_errors_and_closing(self):
+        line = '[01/Mar/2004:13:00:00 -0800]\n'
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self._write_logs(
+                    directory, [[line] * 1000] * 3 + [['no time\n']])
+            with self.assertRaises(IndexError):
+                list(merge_files(*paths, fan_in=2))
+            with self.assertRaises(ValueError):
+                list(merge_files(*paths, fan_in=1))
+            threads = set(threading.enumerate())
+            merged = merge_files(
+                    *paths[:3], batch_size=1, buffer_batches=1, fan_in=2)
+            self._check([line] * 3, itertools.islice(merged, 3))
+            merged.close()
+            threads = set(threading.enumerate()) - threads
+            self.assertTrue(threads)
+            for thread in threads:
+                thread.join(1)
+                self.assertFalse(thread.is_alive())
+
+    def test_extract_range_matches_filtered_merge(self):
+        rnd = random.Random(3)
+        template = '{} {} [{:02}/Mar/2004:{:02}:{:02}:{:02} -0800] "GET"\n'
+        logs = list()
+        for number in range(4):
+            lines = [
+                    template.format(
+                            number, i, rnd.randint(1, 2), rnd.randint(0, 23),
+                            rnd.randint(0, 59), rnd.randint(0, 59))
+                    for i in range(rnd.choice((0, 1, 3000)))]
+            logs.append(sorted(lines, key=log_key))
+        merged = sorted(itertools.chain(*logs), key=log_key)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self._write_logs(directory, logs)
+            for start, end in (
+                    (None, None), (datetime(2004, 3, 1, 14, 2), None),
+                    (None, datetime(2004, 3, 2)),
+                    (datetime(2004, 3, 1, 14, 2), datetime(2004, 3, 1, 14, 7)),
+                    (datetime(2004, 3, 2, 23, 59, 59), datetime(2005, 1, 1)),
+                    (datetime(2003, 1, 1), datetime(2003, 1, 2))):
+                with self.subTest(start=start, end=end):
+                    self._check(
+                            [line for line in merged
+                             if (start is None or start <= log_key(line)) and
+                             (end is None or log_key(line) < end)],
+                            extract_range(*paths, start=start, end=end))
+            moment = log_key(merged[len(merged) // 2])
+            self._check(
+                    [line for line in merged if log_key(line) == moment],
+                    extract_range(
+                            *paths, start=moment,
+                            end=moment + timedelta(seconds=1), key=log_key))
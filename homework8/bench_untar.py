@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from untar import TarParser
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FORMATS = {
+        'ustar': tarfile.USTAR_FORMAT,
+        'gnu': tarfile.GNU_FORMAT}
+LAYOUTS = ('tiny', 'huge', 'deep')
+MTIME = 1396064565
+
+
+class RandomReader:
+    """
+    Файлоподобный объект, возвращающий 'size' случайных байт
+    """
+    def __init__(self, size, rnd):
+        self._left = size
+        self._rnd = rnd
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        self._left -= size
+        return self._rnd.randbytes(size)
+
+
+def make_info(name, rnd, file_type=tarfile.REGTYPE, size=0, linkname=''):
+    info = tarfile.TarInfo(name)
+    info.type = file_type
+    info.size = size
+    info.linkname = linkname
+    info.mode = 0o755 if file_type == tarfile.DIRTYPE else rnd.choice(
+            (0o644, 0o600, 0o755))
+    info.mtime = MTIME + rnd.randint(0, 10 ** 6)
+    info.uid, info.gid = rnd.randint(0, 2000), rnd.randint(0, 2000)
+    info.uname, info.gname = rnd.choice(
+            (('victor', 'victor'), ('root', 'wheel'), ('', '')))
+    return info
+
+
+def build_archive(
+        path: str, layout: str, tar_format: str = 'gnu', files: int = 1000,
+        huge_size: int = 2 ** 20, depth: int = 40, seed: int = 0):
+    """
+    Записывает в path архив модулем tarfile и возвращает суммарный размер
+    файлов в нём. layout: 'tiny' — files файлов по несколько байт,
+    'huge' — три файла размером huge_size, 'deep' — файлы в каталогах
+    вложенности depth (в формате ustar вложенность ограничена длиной пути).
+    В 'tiny' и 'deep' добавляются жёсткая и символическая ссылки
+    """
+    rnd = random.Random(seed)
+    total = 0
+    with tarfile.open(path, 'w', format=FORMATS[tar_format]) as tar:
+        if layout == 'tiny':
+            tar.addfile(make_info('tiny', rnd, tarfile.DIRTYPE))
+            for number in range(files):
+                data = rnd.randbytes(rnd.randint(0, 600))
+                tar.addfile(
+                        make_info(
+                                'tiny/file{}.bin'.format(number), rnd,
+                                size=len(data)),
+                        io.BytesIO(data))
+                total += len(data)
+            if files > 1:
+                tar.addfile(make_info(
+                        'tiny/hardlink.bin', rnd, tarfile.LNKTYPE,
+                        linkname='tiny/file0.bin'))
+                tar.addfile(make_info(
+                        'tiny/symlink.bin', rnd, tarfile.SYMTYPE,
+                        linkname='file1.bin'))
+        elif layout == 'huge':
+            for number in range(3):
+                size = huge_size + number
+                tar.addfile(
+                        make_info('huge{}.bin'.format(number), rnd, size=size),
+                        RandomReader(size, rnd))
+                total += size
+        elif layout == 'deep':
+            if tar_format == 'ustar':
+                depth = min(depth, 15)
+            directory = 'deep'
+            for level in range(depth):
+                directory += '/level{:02}_{}'.format(level, 'x' * 3)
+                tar.addfile(make_info(directory, rnd, tarfile.DIRTYPE))
+                size = rnd.randint(0, 3000)
+                tar.addfile(
+                        make_info(directory + '/data.txt', rnd, size=size),
+                        RandomReader(size, rnd))
+                total += size
+            if depth > 1:
+                tar.addfile(make_info(
+                        directory + '/up.txt', rnd, tarfile.SYMTYPE,
+                        linkname='../data.txt'))
+                # Длинное имя цели в формате gnu записывается отдельно ('K')
+                if tar_format == 'ustar':
+                    directory = 'deep/level00_xxx'
+                tar.addfile(make_info(
+                        'deep/hardlink.txt', rnd, tarfile.LNKTYPE,
+                        linkname=directory + '/data.txt'))
+        else:
+            raise ValueError('unknown layout {}'.format(layout))
+    return total
+
+
+def peak_rss():
+    """
+    Возвращает пиковую резидентную память процесса в байтах
+    (None, если модуля resource нет)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(engine: str, path: str, jobs: int):
+    """
+    Просматривает и распаковывает архив движком engine ('untar' или
+    'tarfile'). Возвращает число файлов, время просмотра и распаковки
+    в секундах и прирост пиковой памяти в мегабайтах на просмотре
+    (таблица файлов) и на распаковке (буферы копирования). Вызывается
+    в отдельном процессе, поэтому прирост относится только к этому замеру
+    """
+    dest = tempfile.mkdtemp(dir=os.path.dirname(path))
+    memory = [peak_rss()]
+    try:
+        start = time.perf_counter()
+        if engine == 'untar':
+            tar = TarParser(path, use_index=False)
+            count = len(list(tar.files()))
+            scanned = time.perf_counter()
+            memory.append(peak_rss())
+            tar.extract(dest, jobs)
+        else:
+            with tarfile.open(path) as tar:
+                count = sum(1 for member in tar.getmembers() if member.isreg())
+                scanned = time.perf_counter()
+                memory.append(peak_rss())
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(dest, filter='data')
+                else:
+                    tar.extractall(dest)
+        finished = time.perf_counter()
+        memory.append(peak_rss())
+    finally:
+        shutil.rmtree(dest)
+    if memory[0] is None:
+        growth = None, None
+    else:
+        growth = tuple(
+                (after - before) / 2 ** 20
+                for before, after in zip(memory, memory[1:]))
+    return (count, scanned - start, finished - scanned) + growth
+
+
+def measure(engine: str, path: str, jobs: int):
+    """
+    Выполняет run в новом процессе: иначе пик памяти, достигнутый
+    на предыдущем архиве, скрывал бы прирост на следующем
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run, engine, path, jobs).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark of untar.py against tarfile')
+    parser.add_argument(
+            '--layouts', default=','.join(LAYOUTS),
+            help='comma separated layouts: ' + ', '.join(LAYOUTS))
+    parser.add_argument(
+            '--formats', default=','.join(FORMATS),
+            help='comma separated formats: ' + ', '.join(FORMATS))
+    parser.add_argument(
+            '--files', type=int, default=20000,
+            help='number of files in the tiny layout')
+    parser.add_argument(
+            '--huge-size', type=int, default=256,
+            help='size of files in the huge layout in megabytes')
+    parser.add_argument(
+            '--depth', type=int, default=40,
+            help='depth of directories in the deep layout')
+    parser.add_argument(
+            '--jobs', type=int, default=1,
+            help='number of threads extracting files with untar.py')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+            '--dir', default=os.path.join(tempfile.gettempdir(), 'tar_bench'),
+            help='directory for generated archives')
+    args = parser.parse_args()
+    layouts = args.layouts.split(',')
+    formats = args.formats.split(',')
+    for name in layouts:
+        if name not in LAYOUTS:
+            parser.error('unknown layout {}'.format(name))
+    for name in formats:
+        if name not in FORMATS:
+            parser.error('unknown format {}'.format(name))
+    os.makedirs(args.dir, exist_ok=True)
+
+    row = '{:>6} {:>6} {:>8} {:>8} {:>9} {:>10} {:>9} {:>8} {:>10}'
+    print(row.format(
+            'layout', 'format', 'engine', 'files', 'scan s', 'extract s',
+            'MB/s', 'scan MB', 'extract MB'))
+    for layout in layouts:
+        for tar_format in formats:
+            path = os.path.join(args.dir, '{}_{}_{}_{}_{}_{}.tar'.format(
+                    layout, tar_format, args.files, args.huge_size,
+                    args.depth, args.seed))
+            if not os.path.exists(path):
+                build_archive(
+                        path, layout, tar_format, args.files,
+                        args.huge_size * 2 ** 20, args.depth, args.seed)
+            megabytes = os.path.getsize(path) / 2 ** 20
+            for engine in ('tarfile', 'untar'):
+                count, scan, extract, *memory = measure(
+                        engine, path, args.jobs)
+                print(row.format(
+                        layout, tar_format, engine, count,
+                        '{:.3f}'.format(scan), '{:.3f}'.format(extract),
+                        '{:.1f}'.format(megabytes / extract if extract else 0),
+                        *('-' if value is None else '{:.1f}'.format(value)
+                          for value in memory)),
+                        flush=True)
+
+
+if __name__ == '__main__':
+    main()
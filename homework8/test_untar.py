@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+
+import contextlib
+import filecmp
+import gzip
+import io
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import unittest
+
+from bench_untar import build_archive
+from untar import TarParser, parse_number
+
+
+def list_files(directory):
+    """
+    Возвращает множество путей файлов (без каталогов) внутри directory
+    """
+    return {
+            os.path.relpath(os.path.join(root, name), directory)
+            for root, _, names in os.walk(directory) for name in names}
+
+
+def build_sparse_archive(path, segments, real_size):
+    """
+    Записывает в path архив с одним разреженным файлом 'sparse.bin'
+    в старом формате GNU (тип 'S'): участки данных 'segments' (смещение,
+    длина) описываются картой в заголовке и записями продолжения.
+    Возвращает содержимое файла
+    """
+    def octal(number, width):
+        return '{:0{}o}'.format(number, width - 1).encode() + b'\x00'
+
+    def sparse_entries(part, count):
+        return b''.join(
+                octal(offset, 12) + octal(size, 12)
+                for offset, size in part).ljust(count * 24, b'\x00')
+
+    data = bytearray(real_size)
+    for number, (offset, size) in enumerate(segments):
+        data[offset:offset + size] = bytes([number + 1]) * size
+    stored = b''.join(data[offset:offset + size] for offset, size in segments)
+    extensions = [segments[start:start + 21] for start in range(
+            4, len(segments), 21)]
+    header = bytearray(512)
+    header[:10] = b'sparse.bin'
+    header[100:108] = octal(0o644, 8)
+    header[108:116] = octal(1000, 8)
+    header[116:124] = octal(1000, 8)
+    header[124:136] = octal(len(stored), 12)
+    header[136:148] = octal(1396064565, 12)
+    header[148:156] = b' ' * 8
+    header[156:157] = b'S'
+    header[257:265] = b'ustar  \x00'
+    header[265:271] = b'victor'
+    header[297:303] = b'victor'
+    header[386:482] = sparse_entries(segments[:4], 4)
+    header[482] = bool(extensions)
+    header[483:495] = octal(real_size, 12)
+    header[148:156] = octal(sum(header), 7) + b' '
+    with open(path, 'wb') as file:
+        file.write(header)
+        for number, part in enumerate(extensions, 1):
+            file.write(
+                    sparse_entries(part, 21) +
+                    bytes([number < len(extensions)]).ljust(8, b'\x00'))
+        file.write(stored.ljust(-(-len(stored) // 512) * 512, b'\x00'))
+        file.write(bytes(1024))
+    return bytes(data)
+
+
+class TestTarParser(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _build(self, layout, tar_format, **kwargs):
+        path = os.path.join(
+                self._dir.name, '{}_{}.tar'.format(layout, tar_format))
+        build_archive(
+                path, layout, tar_format, files=200, huge_size=3 * 2 ** 20,
+                **kwargs)
+        return path
+
+    def _archives(self):
+        for layout in ('tiny', 'huge', 'deep'):
+            for tar_format in ('ustar', 'gnu'):
+                with self.subTest(layout=layout, format=tar_format):
+                    yield self._build(layout, tar_format)
+
+    def _gzip(self, path):
+        with open(path, 'rb') as source, \
+                gzip.open(path + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        return path + '.gz'
+
+    def _check_extracted(self, expected, actual):
+        self.assertSetEqual(list_files(expected), list_files(actual))
+        for name in list_files(expected):
+            expected_path = os.path.join(expected, name)
+            actual_path = os.path.join(actual, name)
+            self.assertTrue(filecmp.cmp(
+                    expected_path, actual_path, shallow=False), name)
+            self.assertEqual(
+                    os.path.islink(expected_path),
+                    os.path.islink(actual_path), name)
+            if os.path.islink(expected_path):
+                self.assertEqual(
+                        os.readlink(expected_path), os.readlink(actual_path))
+            else:
+                self.assertEqual(
+                        os.stat(expected_path).st_nlink,
+                        os.stat(actual_path).st_nlink, name)
+
+    def test_list_same_as_tarfile(self):
+        for path in self._archives():
+            with tarfile.open(path) as tar:
+                expected = sorted(
+                        member.name for member in tar if member.isreg())
+            self.assertListEqual(
+                    expected, sorted(TarParser(path, use_index=False).files()))
+
+    def test_info_same_as_tarfile(self):
+        for path in self._archives():
+            parsers = TarParser(path), TarParser(self._gzip(path))
+            with tarfile.open(path) as tar:
+                for member, parser in itertools.product(tar, parsers):
+                    if not member.isreg():
+                        continue
+                    info = dict(parser.file_stat(member.name))
+                    self.assertDictEqual(info, {
+                            'Filename': member.name,
+                            'Type': 'Regular file',
+                            'Mode': '{:07o}'.format(member.mode),
+                            'UID': str(member.uid),
+                            'GID': str(member.gid),
+                            'Size': str(member.size),
+                            'Modification time': time.strftime(
+                                    '%d %b %Y %H:%M:%S',
+                                    time.localtime(member.mtime)),
+                            'Checksum': str(member.chksum),
+                            'User name': member.uname,
+                            'Group name': member.gname})
+
+    def test_extract_same_as_tarfile(self):
+        for path in self._archives():
+            expected = os.path.join(self._dir.name, 'expected')
+            with tarfile.open(path) as tar:
+                tar.extractall(expected)
+            for jobs in (1, 4):
+                actual = os.path.join(self._dir.name, 'actual')
+                TarParser(path, use_index=False).extract(actual, jobs)
+                self._check_extracted(expected, actual)
+                shutil.rmtree(actual)
+            shutil.rmtree(expected)
+
+    def test_unknown_types_are_skipped(self):
+        path = os.path.join(self._dir.name, 'pax.tar')
+        with tarfile.open(path, 'w', format=tarfile.PAX_FORMAT) as tar:
+            info = tarfile.TarInfo('pax.txt')
+            info.size = 3
+            info.pax_headers = {'comment': 'x header'}
+            tar.addfile(info, io.BytesIO(b'pax'))
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            parser = TarParser(path, use_index=False)
+            self.assertListEqual(['pax.txt'], list(parser.files()))
+            parser.extract(self._dir.name)
+        self.assertIn("типа 'x' пропущен", stderr.getvalue())
+        with open(os.path.join(self._dir.name, 'pax.txt'), 'rb') as file:
+            self.assertEqual(b'pax', file.read())
+
+    def test_last_member_with_same_name_wins(self):
+        path = os.path.join(self._dir.name, 'same.tar')
+        with tarfile.open(path, 'w', format=tarfile.GNU_FORMAT) as tar:
+            for data in (b'first', b'second!', b'third'):
+                info = tarfile.TarInfo('same.txt')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        for _ in range(2):
+            parser = TarParser(path)
+            self.assertListEqual(['same.txt'], list(parser.files()))
+            self.assertEqual('5', dict(parser.file_stat('same.txt'))['Size'])
+            for jobs in (1, 4):
+                parser.extract(self._dir.name, jobs)
+                with open(os.path.join(self._dir.name, 'same.txt')) as file:
+                    self.assertEqual('third', file.read())
+
+    def test_extract_member(self):
+        path = self._build('deep', 'gnu')
+        parser = TarParser(path)
+        with tarfile.open(path) as tar:
+            member = [m for m in tar if m.isreg()][-1]
+            expected = tar.extractfile(member).read()
+        parser.extract_member(member.name, self._dir.name)
+        with open(os.path.join(self._dir.name, member.name), 'rb') as file:
+            self.assertEqual(expected, file.read())
+        with self.assertRaises(ValueError):
+            parser.extract_member('missing', self._dir.name)
+
+    def test_names_outside_destination_are_skipped(self):
+        path = os.path.join(self._dir.name, 'escape.tar')
+        with tarfile.open(path, 'w', format=tarfile.GNU_FORMAT) as tar:
+            for name in (
+                    '/abs/ABS.txt', '../REL.txt', 'a/../../REL2.txt',
+                    'ok/../fine.txt', '..', '/'):
+                info = tarfile.TarInfo(name)
+                info.size = len(name)
+                tar.addfile(info, io.BytesIO(name.encode()))
+            for name, file_type, linkname in (
+                    ('a/b', tarfile.SYMTYPE, '..'),
+                    ('a/b/c', tarfile.SYMTYPE, '..'),
+                    ('up', tarfile.SYMTYPE, '../escape.tar'),
+                    ('hard', tarfile.LNKTYPE, '../escape.tar'),
+                    ('fifo', tarfile.FIFOTYPE, '')):
+                info = tarfile.TarInfo(name)
+                info.type, info.linkname = file_type, linkname
+                tar.addfile(info)
+        self.assertListEqual(
+                ['abs/ABS.txt', 'fine.txt'],
+                sorted(TarParser(path, use_index=False).files()))
+        for archive in (path, self._gzip(path)):
+            dest = os.path.join(self._dir.name, 'dest')
+            with contextlib.redirect_stderr(io.StringIO()):
+                parser = TarParser(archive, use_index=False)
+                parser.extract(dest)
+                parser.extract_member('/abs/ABS.txt', dest)
+            self.assertSetEqual(
+                    {'abs/ABS.txt', 'fine.txt'}, list_files(dest))
+            self.assertTrue(os.path.islink(os.path.join(dest, 'a/b')))
+            self.assertListEqual(
+                    ['a', 'abs', 'fine.txt'], sorted(os.listdir(dest)))
+            self.assertSetEqual(
+                    {'dest', 'escape.tar', 'escape.tar.gz'},
+                    set(os.listdir(self._dir.name)))
+            self.assertFalse(os.path.exists('/abs/ABS.txt'))
+            shutil.rmtree(dest)
+
+    def test_extract_sparse(self):
+        path = os.path.join(self._dir.name, 'sparse.tar')
+        real_size = 2 ** 22
+        segments = [
+                (number * 2 ** 18, 1000 + number) for number in range(6)]
+        expected = build_sparse_archive(path, segments, real_size)
+        with tarfile.open(path) as tar:
+            self.assertEqual(expected, tar.extractfile('sparse.bin').read())
+        untar = os.path.join(os.path.dirname(__file__), 'untar.py')
+        for mode in ('seekable', 'threads', 'gzip', 'stdin'):
+            with self.subTest(mode=mode):
+                dest = os.path.join(self._dir.name, mode)
+                if mode == 'stdin':
+                    os.mkdir(dest)
+                    with open(path, 'rb') as file:
+                        subprocess.run(
+                                [sys.executable, untar, '-x', '-'],
+                                stdin=file, cwd=dest, check=True)
+                else:
+                    parser = TarParser(
+                            self._gzip(path) if mode == 'gzip' else path,
+                            use_index=False)
+                    self.assertListEqual(['sparse.bin'], list(parser.files()))
+                    parser.extract(dest, 4 if mode == 'threads' else 1)
+                result = os.path.join(dest, 'sparse.bin')
+                with open(result, 'rb') as file:
+                    self.assertEqual(expected, file.read())
+                self.assertLess(
+                        os.stat(result).st_blocks * 512, real_size)
+
+    def test_index_is_reused_and_checked(self):
+        path = self._build('tiny', 'gnu')
+        parser = TarParser(path)
+        expected = sorted(parser.files())
+        self.assertTrue(os.path.exists(path + '.idx'))
+        loaded = TarParser(path)
+        self.assertListEqual(expected, sorted(loaded.files()))
+        for name in expected[::50]:
+            self.assertListEqual(
+                    parser.file_stat(name), loaded.file_stat(name))
+        with open(path, 'r+b') as file:
+            file.seek(10)
+            file.write(b'x')
+        self.assertFalse(TarParser(path, use_index=False)._load_index())
+
+    def test_damaged_index_is_rebuilt(self):
+        path = self._build('tiny', 'gnu')
+        expected = sorted(TarParser(path).files())
+        index_size = os.path.getsize(path + '.idx')
+        for size in (200, index_size - 1):
+            with self.subTest(size=size):
+                os.truncate(path + '.idx', size)
+                stderr = io.StringIO()
+                with contextlib.redirect_stderr(stderr):
+                    self.assertListEqual(
+                            expected, sorted(TarParser(path).files()))
+                self.assertIn('повреждён', stderr.getvalue())
+                self.assertEqual(index_size, os.path.getsize(path + '.idx'))
+
+    def test_compressed_stream(self):
+        path = self._build('tiny', 'ustar')
+        self._gzip(path)
+        expected = os.path.join(self._dir.name, 'expected')
+        with tarfile.open(path) as tar:
+            tar.extractall(expected)
+        actual = os.path.join(self._dir.name, 'actual')
+        parser = TarParser(path + '.gz')
+        parser.extract(actual)
+        self._check_extracted(expected, actual)
+        with tarfile.open(path) as tar:
+            self.assertSetEqual(
+                    {member.name for member in tar if member.isreg()},
+                    set(parser.files()))
+
+    def test_verify(self):
+        path = self._build('huge', 'gnu')
+        report = TarParser(path).verify(jobs=2, algorithm='sha256')
+        self.assertEqual(3, len(report))
+        self.assertTrue(all(error is None for _, error, _ in report))
+        with open(path, 'r+b') as file:
+            file.seek(100)
+            file.write(b'7')
+        report = TarParser(path, use_index=False).verify()
+        self.assertEqual('Header checksum mismatch', report[0][1])
+
+    def test_verify_checks_every_header(self):
+        path = self._build('deep', 'gnu')
+        with tarfile.open(path) as tar:
+            members = tar.getmembers()
+        report = TarParser(path).verify(jobs=2, algorithm='md5')
+        names = [name.rstrip('/') for name, _, _ in report]
+        self.assertTrue(all(error is None for _, error, _ in report))
+        self.assertTrue({member.name for member in members} <= set(names))
+        # Длинные имена и цели ссылок записаны отдельными заголовками
+        self.assertGreater(len(report), len(members))
+        for name, (_, _, digest) in zip(names, report):
+            with self.subTest(name=name):
+                member = next((m for m in members if m.name == name), None)
+                self.assertEqual(
+                        member is not None and member.isreg(),
+                        digest is not None)
+        self.assertEqual(members[0].name, names[0])
+        self.assertTrue(members[0].isdir())
+        with open(path, 'r+b') as file:
+            file.seek(members[0].offset + 100)
+            file.write(b'7')
+        report = TarParser(path, use_index=False).verify()
+        self.assertEqual(
+                (members[0].name + '/', 'Header checksum mismatch', None),
+                report[0])
+        self.assertTrue(all(error is None for _, error, _ in report[1:]))
+
+    def test_verify_damaged_headers_from_command_line(self):
+        untar = os.path.join(os.path.dirname(__file__), 'untar.py')
+        for position, data, error in (
+                (124, b'z' * 11, 'Header is damaged'),
+                (156, b'x', 'Header checksum mismatch')):
+            with self.subTest(error=error):
+                path = self._build('tiny', 'gnu')
+                with tarfile.open(path) as tar:
+                    members = tar.getmembers()
+                with open(path, 'r+b') as file:
+                    file.seek(members[1].offset + position)
+                    file.write(data)
+                result = subprocess.run(
+                        [sys.executable, untar, '--verify', '--no-index',
+                         path],
+                        capture_output=True, text=True)
+                self.assertNotEqual(0, result.returncode)
+                lines = result.stdout.splitlines()
+                self.assertEqual('tiny/: OK', lines[0])
+                self.assertTrue(lines[1].startswith(
+                        '{}: {}'.format(members[1].name, error)))
+                if error == 'Header checksum mismatch':
+                    self.assertEqual(len(members), len(lines))
+
+    def test_parse_number(self):
+        self.assertEqual(0o644, parse_number(b'0000644\x00'))
+        self.assertEqual(0, parse_number(b'\x00' * 12))
+        self.assertEqual(
+                2 ** 40, parse_number(b'\x80' + (2 ** 40).to_bytes(11, 'big')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,37 @@
 #!/usr/bin/env python3
 
 import argparse
+import bz2
+import errno
+import gzip
+import hashlib
+import json
+import lzma
+import mmap
 import os.path
-import struct
 import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import NamedTuple
 
 
+COMPRESSED_FORMATS = (
+        (b'\x1f\x8b', gzip.open),
+        (b'BZh', bz2.open),
+        (b'\xfd7zXZ\x00', lzma.open))
+INDEX_MAGIC = b'TARIDX5\n'
+INDEX_SUFFIX = '.idx'
+
+
 class TarParser:
-    _HEADER_FMT1 = '100s8s8s8s12s12s8sc100s255s'  # 10(9)8
-    _HEADER_FMT2 = '6s2s32s32s8s8s155s12s'  # 8   15
-    _HEADER_FMT3 = '6s2s32s32s8s8s12s12s112s31x'  # 10
     _READ_BLOCK = 16 * 2 ** 20
     _RECORD_SIZE = 512
 
     _FILE_TYPES = {
+            b'\x00': 'Regular file',
             b'0': 'Regular file',
             b'1': 'Hard link',
             b'2': 'Symbolic link',
@@ -33,57 +49,549 @@ class TarParser:
             b'V': "`name' is tape/volume header name"
             }
 
-    def __init__(self, filename):
+    def __init__(self, filename, use_index=True):
         """
-        Открывает tar-архив 'filename' и производит его предобработку
-        (если требуется)
+        Открывает tar-архив 'filename'. Архив просматривается при первом
+        обращении к таблице файлов, поэтому verify работает и с архивом,
+        заголовки которого повреждены.
+
+        Если 'use_index', таблица файлов несжатого архива сохраняется
+        в файл рядом с ним и при следующих открытиях загружается оттуда
+        без просмотра архива
         """
         self._archive_name = filename
-        self._files_stat = dict()
-        with open(filename, 'rb') as arch:
-            record = arch.read(self._RECORD_SIZE)
-            while self._decode(record):
-                header = self._get_full_header(record)
-                if self._FILE_TYPES[header[7]] == 'Regular file':
-                    self._files_stat[self._decode(header[0])] = header
-                file_size = convert_to_dec_from_oct(self._decode(header[4]))
-                if file_size % self._RECORD_SIZE != 0:
-                    file_size += \
-                        self._RECORD_SIZE - file_size % self._RECORD_SIZE
-                arch.seek(file_size, 1)
-                record = arch.read(self._RECORD_SIZE)
+        self._members = _MemberTable()
+        self._directories = list()
+        self._links = list()
+        self._stream = filename == '-' or get_opener(filename) is not None
+        self._use_index = use_index
+        self._scanned = False
 
-    def extract(self, dest=os.getcwd()):
+    def _get_index_key(self):
         """
-        Распаковывает данный tar-архив в каталог 'dest'
+        Возвращает размер, время изменения и хеш первого заголовка архива,
+        по которым проверяется, что индекс построен для этой версии архива
         """
-
+        info = os.stat(self._archive_name)
         with open(self._archive_name, 'rb') as arch:
+            header_hash = hashlib.sha1(arch.read(self._RECORD_SIZE))
+        return {
+                'size': info.st_size,
+                'mtime_ns': info.st_mtime_ns,
+                'header_hash': header_hash.hexdigest()}
+
+    def _save_index(self):
+        """
+        Записывает индекс архива: INDEX_MAGIC, длина заголовка (4 байта),
+        заголовок в JSON и массивы таблицы файлов
+        """
+        header = self._get_index_key()
+        header.update({
+                'byteorder': sys.byteorder,
+                'itemsizes': self._members.itemsizes(),
+                'table': self._members.describe(),
+                'directories': self._directories,
+                'links': self._links})
+        header = json.dumps(header).encode()
+        # Таблица начинается с позиции, кратной 8 (см. _MemberTable.tofile)
+        header += b' ' * (-(len(INDEX_MAGIC) + 4 + len(header)) % 8)
+        index_path = self._archive_name + INDEX_SUFFIX
+        temporary = index_path + '.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(INDEX_MAGIC)
+                file.write(len(header).to_bytes(4, 'little'))
+                file.write(header)
+                self._members.tofile(file)
+            os.replace(temporary, index_path)
+        except OSError as e:
+            print(
+                    'Не удалось сохранить индекс {}: {}'.format(index_path, e),
+                    file=sys.stderr)
+
+    def _load_index(self):
+        """
+        Загружает таблицу файлов из индекса архива. Возвращает False,
+        если индекса нет, он построен для другой версии архива или
+        повреждён (тогда таблица строится заново просмотром архива)
+        """
+        index_path = self._archive_name + INDEX_SUFFIX
+        try:
+            file = open(index_path, 'rb')
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(
+                    'Не удалось прочитать индекс {}: {}'.format(index_path, e),
+                    file=sys.stderr)
+            return False
+        try:
+            with file:
+                if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return False
+                length = int.from_bytes(file.read(4), 'little')
+                header = json.loads(file.read(length))
+                if any(header[key] != value
+                       for key, value in self._get_index_key().items()) or \
+                        header['byteorder'] != sys.byteorder or \
+                        header['itemsizes'] != self._members.itemsizes():
+                    print(
+                            'Индекс {} устарел и не используется'.format(
+                                    index_path),
+                            file=sys.stderr)
+                    return False
+                members = _MemberTable()
+                members.fromfile(file, header['table'])
+                directories = header['directories']
+                links = list(map(tuple, header['links']))
+        except (ValueError, KeyError, TypeError, EOFError, OSError) as e:
+            print(
+                    'Индекс {} повреждён и не используется: {}'.format(
+                            index_path, e),
+                    file=sys.stderr)
+            return False
+        self._members = members
+        self._directories = directories
+        self._links = links
+        return True
+
+    def _scan(self, arch, dest=None, member=None):
+        """
+        Читает подряд заголовки архива 'arch' и запоминает информацию
+        о файлах. Если указан 'dest', в него сразу распаковываются каталоги,
+        файлы и в конце ссылки (или только файл 'member'). Для потокового
+        архива данные читаются последовательно, без seek
+        """
+        self._members = _MemberTable()
+        self._directories = list()
+        self._links = list()
+        if member is not None:
+            member = os.path.normpath(member.lstrip('/')).encode()
+        long_name = long_linkname = None
+        position = 0
+        record = arch.read(self._RECORD_SIZE)
+        while record.strip(b'\x00'):
+            if len(record) < self._RECORD_SIZE:
+                raise ValueError('Unexpected end of archive')
+            file_type = self._FILE_TYPES.get(record[156:157])
+            name = record[:100].split(b'\x00', 1)[0]
+            if record[257:263] == b'ustar\x00' and record[345]:
+                name = record[345:500].split(b'\x00', 1)[0] + b'/' + name
+            file_size = parse_number(record[124:136])
+            padded_size = file_size
+            if file_size % self._RECORD_SIZE != 0:
+                padded_size += \
+                    self._RECORD_SIZE - file_size % self._RECORD_SIZE
+            position += self._RECORD_SIZE + padded_size
+            if file_type == 'Long pathname':
+                long_name = self._read_exactly(arch, padded_size)
+                long_name = long_name[:file_size].split(b'\x00', 1)[0]
+                record = arch.read(self._RECORD_SIZE)
+                continue
+            if file_type == 'Long linkname':
+                long_linkname = self._read_exactly(arch, padded_size)
+                long_linkname = \
+                    long_linkname[:file_size].split(b'\x00', 1)[0]
+                record = arch.read(self._RECORD_SIZE)
+                continue
+            if long_name is not None:
+                name, long_name = long_name, None
+            linkname, long_linkname = long_linkname, None
+            skip_size = padded_size
+            sparse_map = real_size = None
+            if file_type == "`sparse' regular file":
+                sparse_map = self._parse_sparse(record[386:482], 4)
+                real_size = parse_number(record[483:495])
+                extended = record[482]
+                while extended:
+                    extension = self._read_exactly(arch, self._RECORD_SIZE)
+                    sparse_map += self._parse_sparse(extension, 21)
+                    extended = extension[504]
+                    position += self._RECORD_SIZE
+            is_file = file_type in ('Regular file', "`sparse' regular file")
+            is_link = file_type in ('Hard link', 'Symbolic link')
+            if is_file or is_link or file_type == 'Directory':
+                name = self._check_name(name)
+            else:
+                print(
+                        'Файл {} типа {!r} пропущен'.format(
+                                name.decode(errors='replace'),
+                                file_type or record[156:157].decode(
+                                        errors='replace')),
+                        file=sys.stderr)
+            if is_file and name is not None:
+                self._members.append(
+                        name, record, position - padded_size,
+                        file_size if real_size is None else real_size,
+                        sparse_map)
+                if dest is not None and member in (None, name):
+                    path = Path(dest, name.decode())
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(path, 'wb') as file:
+                        if sparse_map is None:
+                            self._copy_stream(arch, file, file_size)
+                        else:
+                            for data_offset, data_size in sparse_map:
+                                file.seek(data_offset)
+                                self._copy_stream(arch, file, data_size)
+                            file.truncate(real_size)
+                    skip_size -= file_size
+            elif file_type == 'Directory' and name is not None:
+                self._directories.append(name.decode())
+                if dest is not None and member is None:
+                    Path(dest, name.decode()).mkdir(
+                            parents=True, exist_ok=True)
+            elif is_link and name is not None:
+                if linkname is None:
+                    linkname = record[157:257].split(b'\x00', 1)[0]
+                linkname = self._check_link(name, file_type, linkname)
+                if linkname is not None:
+                    self._links.append(
+                            (name.decode(), file_type, linkname.decode()))
+            self._skip(arch, skip_size)
             record = arch.read(self._RECORD_SIZE)
-            while self._decode(record):
-                header = self._get_full_header(record)
-                filename = self._decode(header[0])
-                file_size = convert_to_dec_from_oct(self._decode(header[4]))
-                path = Path(dest + '\\' + filename)
-                if self._FILE_TYPES[header[7]] == 'Directory':
-                    Path.mkdir(path)
-                    arch.seek(file_size, 1)
+        self._scanned = True
+        if dest is not None and member is None:
+            self._make_links(dest)
+
+    @staticmethod
+    def _check_name(name):
+        """
+        Возвращает имя файла архива (bytes) относительно каталога
+        распаковки: без ведущих '/' и лишних компонент пути. Если имя
+        выходит за пределы каталога распаковки, пишет предупреждение
+        и возвращает None (имя самого каталога распаковки, например './',
+        пропускается молча)
+        """
+        if name and b'/.' not in name and b'//' not in name and \
+                not name.startswith((b'/', b'.')) and \
+                not name.endswith(b'/'):
+            # Имя без '.', '..' и лишних '/' — normpath его не изменит
+            return name
+        checked = os.path.normpath(name.lstrip(b'/'))
+        if checked == b'.':
+            return None
+        if os.path.isabs(checked) or \
+                checked.split(os.sep.encode(), 1)[0] == b'..':
+            print(
+                    'Файл {} вне каталога распаковки пропущен'.format(
+                            name.decode(errors='replace')),
+                    file=sys.stderr)
+            return None
+        return checked
+
+    @staticmethod
+    def _check_link(name, file_type, linkname):
+        """
+        Возвращает цель ссылки 'name' (bytes): для жёсткой ссылки — имя
+        файла относительно каталога распаковки, для символической — как
+        в архиве. Если цель выходит за пределы каталога распаковки, пишет
+        предупреждение и возвращает None
+        """
+        if file_type == 'Hard link':
+            linkname = resolved = os.path.normpath(linkname.lstrip(b'/'))
+        else:
+            resolved = os.path.normpath(
+                    os.path.join(os.path.dirname(name), linkname))
+        if os.path.isabs(resolved) or \
+                resolved.split(os.sep.encode(), 1)[0] == b'..':
+            print(
+                    'Ссылка {} на {} вне каталога распаковки пропущена'.format(
+                            name.decode(errors='replace'),
+                            linkname.decode(errors='replace')),
+                    file=sys.stderr)
+            return None
+        return linkname
+
+    def _make_links(self, dest):
+        """
+        Создаёт в каталоге 'dest' жёсткие и символические ссылки архива.
+        Вызывается после записи обычных файлов, на которые они указывают.
+        Ссылка пропускается, если её каталог или цель с учётом уже
+        созданных символических ссылок оказываются вне 'dest'
+        """
+        root = os.path.realpath(dest)
+        for name, file_type, linkname in self._links:
+            path = Path(dest, name)
+            target = Path(dest, linkname) if file_type == 'Hard link' \
+                else path.parent / linkname
+            if any(os.path.commonpath([root, os.path.realpath(item)]) != root
+                   for item in (path.parent, target)):
+                print(
+                        'Ссылка {} на {} вне каталога распаковки пропущена'
+                        .format(name, linkname),
+                        file=sys.stderr)
+                continue
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if os.path.lexists(path):
+                    path.unlink()
+                if file_type == 'Hard link':
+                    os.link(Path(dest, linkname), path)
                 else:
-                    with open(path, 'wb') as file:
-                        r = arch.read(file_size)
-                        file.write(r.strip(b'\x00'))
-                if file_size % self._RECORD_SIZE != 0:
-                    arch.seek(
-                            self._RECORD_SIZE - file_size % self._RECORD_SIZE,
-                            1)
-                record = arch.read(self._RECORD_SIZE)
+                    os.symlink(linkname, path)
+            except OSError as e:
+                print(
+                        'Не удалось создать ссылку {}: {}'.format(name, e),
+                        file=sys.stderr)
+
+    def _parse_sparse(self, area, count):
+        """
+        Возвращает список участков (смещение, длина) с данными разреженного
+        файла из не более чем 'count' записей карты 'area' формата GNU
+        """
+        sparse_map = list()
+        for start in range(0, count * 24, 24):
+            entry = area[start:start + 24]
+            if not entry.strip(b'\x00'):
+                break
+            sparse_map.append(
+                    (parse_number(entry[:12]), parse_number(entry[12:])))
+        return sparse_map
+
+    def _read_exactly(self, arch, size):
+        data = arch.read(size)
+        if len(data) < size:
+            raise ValueError('Unexpected end of archive')
+        return data
+
+    def _open_stream(self):
+        """
+        Открывает потоковый архив (stdin или сжатый файл) на чтение,
+        распаковывая его на лету
+        """
+        if self._archive_name != '-':
+            return get_opener(self._archive_name)(self._archive_name, 'rb')
+        if self._scanned:
+            raise ValueError('Archive from stdin can be read only once')
+        arch = sys.stdin.buffer
+        for magic, opener in COMPRESSED_FORMATS:
+            if arch.peek(len(magic)).startswith(magic):
+                return opener(arch, 'rb')
+        return arch
+
+    def _ensure_scanned(self):
+        """
+        Строит таблицу файлов, если она ещё не построена: загружает её
+        из индекса или просматривает архив (и сохраняет индекс)
+        """
+        if self._scanned:
+            return
+        if self._stream:
+            with self._open_stream() as arch:
+                self._scan(arch)
+            return
+        if self._use_index and self._load_index():
+            self._scanned = True
+            return
+        with open(self._archive_name, 'rb') as arch:
+            self._scan(arch)
+        if self._use_index:
+            self._save_index()
+
+    def _skip(self, arch, size):
+        if not self._stream:
+            arch.seek(size, 1)
+            return
+        while size > 0:
+            data = arch.read(min(size, self._READ_BLOCK))
+            if not data:
+                raise ValueError('Unexpected end of archive')
+            size -= len(data)
+
+    def _copy_stream(self, arch, file, file_size):
+        """
+        Копирует в файл 'file' ровно 'file_size' байт с текущей позиции
+        архива 'arch' блоками не больше _READ_BLOCK байт
+        """
+        while file_size > 0:
+            data = arch.read(min(file_size, self._READ_BLOCK))
+            if not data:
+                raise ValueError('Unexpected end of archive')
+            file.write(data)
+            file_size -= len(data)
+
+    def extract(self, dest=os.getcwd(), jobs=1):
+        """
+        Распаковывает данный tar-архив в каталог 'dest'.
+
+        Сначала создаются все каталоги, затем файлы записываются в 'jobs'
+        потоков, читающих архив позиционным чтением из общего дескриптора,
+        и в конце создаются ссылки. Потоковый архив распаковывается за один
+        последовательный проход
+        """
+        if self._stream:
+            with self._open_stream() as arch:
+                self._scan(arch, dest)
+            return
+        self._ensure_scanned()
+        positions = [
+                (self._members.name(index), index)
+                for index in self._members.latest()]
+        for directory in self._directories:
+            Path(dest, directory).mkdir(parents=True, exist_ok=True)
+        for parent in {os.path.dirname(filename) for filename, _ in positions}:
+            Path(dest, parent).mkdir(parents=True, exist_ok=True)
+        with open(self._archive_name, 'rb') as arch:
+            if jobs > 1 and hasattr(os, 'pread'):
+                with ThreadPoolExecutor(jobs) as executor:
+                    for _ in executor.map(
+                            lambda item: self._write_member(arch, *item, dest),
+                            positions):
+                        pass
+            else:
+                for filename, index in positions:
+                    self._write_member(arch, filename, index, dest)
+        self._make_links(dest)
+
+    def extract_member(self, filename, dest=os.getcwd()):
+        """
+        Распаковывает файл 'filename' из данного tar-архива в каталог 'dest',
+        не просматривая остальные файлы архива (потоковый архив
+        просматривается до конца)
+        """
+        filename = os.path.normpath(filename.lstrip('/'))
+        if self._stream:
+            with self._open_stream() as arch:
+                self._scan(arch, dest, filename)
+            if self._members.find(filename) is None:
+                raise ValueError(filename)
+            return
+        self._ensure_scanned()
+        index = self._members.find(filename)
+        if index is None:
+            raise ValueError(filename)
+        Path(dest, filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(self._archive_name, 'rb') as arch:
+            self._write_member(arch, filename, index, dest)
+
+    def _write_member(self, arch, filename, index, dest):
+        offset = self._members.offsets[index]
+        sparse_map = self._members.sparse.get(index)
+        with open(Path(dest, filename), 'wb') as file:
+            if sparse_map is None:
+                self._copy(arch, file, offset, self._members.sizes[index])
+                return
+            for data_offset, data_size in sparse_map:
+                file.seek(data_offset)
+                self._copy(arch, file, offset, data_size)
+                offset += data_size
+            file.truncate(self._members.sizes[index])
+
+    def _copy(self, arch, file, offset, file_size):
+        """
+        Копирует в файл 'file' ровно 'file_size' байт архива 'arch', начиная
+        со смещения 'offset', блоками не больше _READ_BLOCK байт.
+        По возможности данные копируются ядром (copy_file_range, sendfile),
+        не попадая в память процесса
+        """
+        file.flush()
+        arch_fd, file_fd = arch.fileno(), file.fileno()
+        end = offset + file_size
+        for copy in _COPY_FUNCTIONS:
+            try:
+                while offset < end:
+                    copied = copy(
+                            arch_fd, file_fd, offset,
+                            min(end - offset, self._READ_BLOCK))
+                    if not copied:
+                        raise ValueError('Unexpected end of archive')
+                    offset += copied
+                return
+            except OSError as e:
+                if e.errno not in _COPY_UNSUPPORTED:
+                    raise
+
+    def verify(self, jobs=1, algorithm=None):
+        """
+        Проверяет целостность архива и возвращает список троек (имя,
+        описание ошибки или None, хеш данных или None) для каждой записи
+        заголовка: файлов, каталогов, ссылок, длинных имён ('L', 'K')
+        и разреженных файлов.
+
+        Для каждого заголовка проверяются контрольная сумма, наличие данных
+        и нулевое дополнение до границы блока. Если указан 'algorithm' (имя
+        из hashlib), считается хеш данных обычных и разреженных файлов.
+        Заголовки находятся последовательным проходом по архиву, делятся
+        на непересекающиеся диапазоны и проверяются в 'jobs' процессах
+        позиционным чтением
+        """
+        if self._stream:
+            raise ValueError(
+                    'Only an uncompressed archive file can be verified')
+        with open(self._archive_name, 'rb') as arch:
+            members, error = self._walk_headers(arch)
+        if jobs <= 1:
+            report = verify_members(self._archive_name, members, algorithm)
+        else:
+            step = -(-len(members) // (jobs * 4)) or 1
+            ranges = [
+                    members[start:start + step]
+                    for start in range(0, len(members), step)]
+            report = list()
+            with ProcessPoolExecutor(jobs) as executor:
+                for part in executor.map(
+                        verify_members, [self._archive_name] * len(ranges),
+                        ranges, [algorithm] * len(ranges)):
+                    report.extend(part)
+        if error is not None:
+            report.append(error)
+        return report
+
+    def _walk_headers(self, arch):
+        """
+        Проходит по заголовкам архива 'arch', пропуская данные, и возвращает
+        список пятёрок (имя, смещение заголовка, смещение данных, размер
+        данных, хешировать ли данные) и тройку отчёта с ошибкой, если
+        дальше заголовки разобрать нельзя (иначе None)
+        """
+        members = list()
+        long_name = None
+        position = 0
+        while True:
+            record = _pread(arch, self._RECORD_SIZE, position)
+            if not record.strip(b'\x00'):
+                return members, None
+            name = record[:100].split(b'\x00', 1)[0]
+            if len(record) < self._RECORD_SIZE:
+                return members, (
+                        name.decode(errors='replace'), 'Header is truncated',
+                        None)
+            file_type = self._FILE_TYPES.get(record[156:157])
+            if record[257:263] == b'ustar\x00' and record[345]:
+                name = record[345:500].split(b'\x00', 1)[0] + b'/' + name
+            if long_name is not None and \
+                    file_type not in ('Long pathname', 'Long linkname'):
+                name, long_name = long_name, None
+            name = name.decode(errors='replace')
+            offset = position + self._RECORD_SIZE
+            try:
+                size = parse_number(record[124:136])
+                extended = file_type == "`sparse' regular file" and \
+                    record[482]
+                while extended:
+                    extension = _pread(arch, self._RECORD_SIZE, offset)
+                    if len(extension) < self._RECORD_SIZE:
+                        return members, (name, 'Header is truncated', None)
+                    extended = extension[504]
+                    offset += self._RECORD_SIZE
+                if file_type == 'Long pathname':
+                    long_name = _pread(arch, size, offset).split(
+                            b'\x00', 1)[0]
+            except ValueError as e:
+                return members, (name, 'Header is damaged: {}'.format(e), None)
+            members.append((
+                    name, position, offset, size,
+                    file_type in ('Regular file', "`sparse' regular file")))
+            position = offset + size + -size % self._RECORD_SIZE
 
     def files(self):
         """
         Возвращает итератор имён файлов (с путями) в архиве
         """
-        for filename in self._files_stat.keys():
-            yield filename
+        self._ensure_scanned()
+        for index in self._members.latest():
+            yield self._members.name(index)
 
     def file_stat(self, filename):
         """
@@ -104,29 +612,221 @@ class TarParser:
             ('Group name', 'victor')
         ]
         """
-        if filename not in self.files():
+        self._ensure_scanned()
+        index = self._members.find(filename)
+        if index is None:
             raise ValueError(filename)
 
-        info = [('Filename', filename)]
+        members = self._members
+        file_type = b'S' if index in members.sparse else b'0'
+        return [
+                ('Filename', filename),
+                ('Type', self._FILE_TYPES[file_type]),
+                ('Mode', '{:07o}'.format(members.number(index, 'mode'))),
+                ('UID', str(members.number(index, 'uid'))),
+                ('GID', str(members.number(index, 'gid'))),
+                ('Size', str(members.sizes[index])),
+                ('Modification time', time.strftime(
+                        '%d %b %Y %H:%M:%S',
+                        time.localtime(members.number(index, 'mtime')))),
+                ('Checksum', str(members.number(index, 'chksum'))),
+                ('User name', members.user_name(index)),
+                ('Group name', members.group_name(index))]
 
-        # TODO
 
-        return info
+class _MemberTable:
+    """
+    Компактная таблица файлов архива: имена хранятся подряд в одном буфере,
+    смещения и размеры данных — в массивах, числовые поля заголовка (права
+    доступа, владелец, время изменения, контрольная сумма) — как есть,
+    в байтах заголовка, и разбираются только при запросе. Пары имён
+    пользователя и группы хранятся один раз, в массиве — их номера.
 
-    def _get_full_header(self, headers):
-        headers = struct.unpack(self._HEADER_FMT1, headers)
-        header_part2 = headers[-1]
-        if header_part2.startswith(b'ustar\x00'):
-            header_part2 = struct.unpack(self._HEADER_FMT2, header_part2)
-        elif header_part2.startswith(b'ustar '):
-            header_part2 = struct.unpack(self._HEADER_FMT3, header_part2)
-        else:
-            return headers[:-1]
-        return headers[:-1] + header_part2
+    Поиск по имени идёт по хеш-таблице с открытой адресацией: массиву
+    номеров записей (со сдвигом на 1, 0 — пустая ячейка), в который
+    попадает последняя запись каждого имени. Таблица строится при первом
+    поиске и сохраняется в индекс вместе с остальными массивами
+    """
+    __slots__ = (
+            '_names', '_name_ends', 'offsets', 'sizes', '_fields', '_owners',
+            '_owner_ids', '_owner_numbers', 'sparse', '_slots', '_shadowed')
 
-    @staticmethod
-    def _decode(coded):
-        return coded.strip(b'\x00').decode()
+    _ARRAYS = ('_name_ends', 'offsets', 'sizes', '_owners')
+    # Поля заголовка в _fields: имя -> (начало, конец) внутри записи
+    # из байт 100:124 (mode, uid, gid) и 136:156 (mtime, chksum) заголовка
+    _FIELDS = {
+            'mode': (0, 8), 'uid': (8, 16), 'gid': (16, 24),
+            'mtime': (24, 36), 'chksum': (36, 44)}
+    _FIELDS_SIZE = 44
+
+    def __init__(self):
+        self._names = bytearray()
+        self._name_ends = array('Q')
+        self.offsets = array('Q')
+        self.sizes = array('Q')
+        self._fields = bytearray()
+        self._owners = array('I')
+        self._owner_ids = list()
+        self._owner_numbers = dict()
+        self.sparse = dict()
+        self._slots = None
+        self._shadowed = None
+
+    def __len__(self):
+        return len(self._name_ends)
+
+    def append(self, name, record, offset, size, sparse_map):
+        """
+        Добавляет файл с именем 'name' (bytes) и заголовком 'record',
+        данные которого начинаются со смещения 'offset'. Для разреженного
+        файла 'sparse_map' — список участков с данными (смещение, длина),
+        иначе None
+        """
+        if sparse_map is not None:
+            self.sparse[len(self)] = sparse_map
+        self._names += name
+        self._name_ends.append(len(self._names))
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self._fields += record[100:124]
+        self._fields += record[136:156]
+        owner = record[265:329]
+        number = self._owner_numbers.get(owner)
+        if number is None:
+            number = self._owner_numbers[owner] = len(self._owner_ids)
+            self._owner_ids.append(owner)
+        self._owners.append(number)
+        self._slots = self._shadowed = None
+
+    def describe(self):
+        """
+        Возвращает описание таблицы для заголовка индекса (JSON)
+        """
+        self._build_slots()
+        return {
+                'members': len(self),
+                'names': len(self._names),
+                'slots': len(self._slots),
+                'shadowed': self._shadowed,
+                'owners': [owner.hex() for owner in self._owner_ids],
+                'sparse': list(self.sparse.items())}
+
+    def itemsizes(self):
+        return [getattr(self, name).itemsize for name in self._ARRAYS]
+
+    def tofile(self, file):
+        """
+        Записывает массивы и буферы таблицы в файл 'file'. Массивы идут
+        по убыванию размера элемента, так что при записи с позиции,
+        кратной 8, каждый из них выровнен для отображения в память
+        """
+        self._build_slots()
+        for name in self._ARRAYS:
+            getattr(self, name).tofile(file)
+        self._slots.tofile(file)
+        file.write(self._fields)
+        file.write(self._names)
+
+    def fromfile(self, file, description):
+        """
+        Отображает в память таблицу, записанную tofile с текущей позиции
+        файла 'file', по её описанию 'description' (см. describe).
+        Массивы становятся представлениями отображения, поэтому страницы
+        индекса читаются с диска, только когда к ним обращаются
+        """
+        count = description['members']
+        view = memoryview(mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ))
+        position = file.tell()
+        sections = [
+                (name, getattr(self, name).typecode, count)
+                for name in self._ARRAYS]
+        sections += [
+                ('_slots', 'I', description['slots']),
+                ('_fields', 'B', count * self._FIELDS_SIZE),
+                ('_names', 'B', description['names'])]
+        for name, typecode, length in sections:
+            size = length * array(typecode).itemsize
+            if position + size > len(view):
+                raise EOFError('Index is truncated')
+            setattr(self, name, view[position:position + size].cast(typecode))
+            position += size
+        self._shadowed = description['shadowed']
+        self._owner_ids = [
+                bytes.fromhex(owner) for owner in description['owners']]
+        self.sparse = {
+                index: list(map(tuple, sparse_map))
+                for index, sparse_map in description['sparse']}
+
+    def _name_bytes(self, index):
+        start = self._name_ends[index - 1] if index else 0
+        return self._names[start:self._name_ends[index]]
+
+    def name(self, index):
+        return bytes(self._name_bytes(index)).decode()
+
+    def number(self, index, field):
+        """
+        Возвращает значение числового поля 'field' заголовка (см. _FIELDS)
+        """
+        start, end = self._FIELDS[field]
+        base = index * self._FIELDS_SIZE
+        return parse_number(bytes(self._fields[base + start:base + end]))
+
+    def user_name(self, index):
+        owner = self._owner_ids[self._owners[index]]
+        return owner[:32].split(b'\x00', 1)[0].decode()
+
+    def group_name(self, index):
+        owner = self._owner_ids[self._owners[index]]
+        return owner[32:].split(b'\x00', 1)[0].decode()
+
+    def _build_slots(self):
+        """
+        Строит хеш-таблицу поиска по имени и список номеров записей,
+        имена которых повторяются дальше в архиве
+        """
+        if self._slots is not None:
+            return
+        size = 1 << (2 * len(self)).bit_length()
+        mask = size - 1
+        slots = array('I', [0]) * size
+        shadowed = list()
+        for index in range(len(self)):
+            name = self._name_bytes(index)
+            slot = zlib.crc32(name) & mask
+            while slots[slot]:
+                if self._name_bytes(slots[slot] - 1) == name:
+                    shadowed.append(slots[slot] - 1)
+                    break
+                slot = (slot + 1) & mask
+            slots[slot] = index + 1
+        self._slots, self._shadowed = slots, shadowed
+
+    def find(self, name):
+        """
+        Возвращает номер последней записи файла 'name' или None
+        """
+        self._build_slots()
+        name = name.encode()
+        mask = len(self._slots) - 1
+        slot = zlib.crc32(name) & mask
+        while self._slots[slot]:
+            if self._name_bytes(self._slots[slot] - 1) == name:
+                return self._slots[slot] - 1
+            slot = (slot + 1) & mask
+        return None
+
+    def latest(self):
+        """
+        Возвращает итератор номеров последних записей каждого имени
+        в порядке архива
+        """
+        self._build_slots()
+        shadowed = set(self._shadowed)
+        return (
+                index for index in range(len(self))
+                if index not in shadowed)
 
 
 class TarHeader(NamedTuple):
@@ -142,10 +842,122 @@ class TarHeader(NamedTuple):
     extends: str
 
 
-def convert_to_dec_from_oct(num: str):
-    if num.startswith('0o'):
-        return int(num, 8)
-    return int('0o' + num, 8)
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _read_write(src_fd, dst_fd, offset, count):
+    if hasattr(os, 'pread'):
+        data = os.pread(src_fd, count, offset)
+    else:
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        data = os.read(src_fd, count)
+    return os.write(dst_fd, data) if data else 0
+
+
+# Способы копирования части файла в порядке предпочтения: функция
+# (src_fd, dst_fd, offset, count) -> число скопированных байт
+_COPY_FUNCTIONS = tuple(
+        copy for copy, name in (
+                (_copy_file_range, 'copy_file_range'),
+                (_sendfile, 'sendfile'),
+                (_read_write, 'read'))
+        if hasattr(os, name))
+# Ошибки, при которых следует перейти к следующему способу копирования
+_COPY_UNSUPPORTED = {
+        getattr(errno, name) for name in (
+                'ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP',
+                'ENOTSOCK', 'EBADF')
+        if hasattr(errno, name)}
+
+
+def get_opener(filename):
+    """
+    Возвращает функцию для потокового чтения сжатого файла,
+    определяя формат по сигнатуре. Для несжатого файла возвращает None.
+    """
+    with open(filename, 'rb') as file:
+        signature = file.read(8)
+    for magic, opener in COMPRESSED_FORMATS:
+        if signature.startswith(magic):
+            return opener
+    return None
+
+
+def parse_number(field: bytes):
+    """
+    Возвращает число из числового поля заголовка: восьмеричная запись
+    или, если установлен старший бит первого байта, двоичная (GNU)
+    """
+    if field[:1] and field[0] & 0x80:
+        return int.from_bytes(field[1:], 'big')
+    return int(field.strip(b'\x00 ') or b'0', 8)
+
+
+def header_checksum(record: bytes):
+    """
+    Возвращает контрольные суммы заголовка: сумму байт без знака и со
+    знаком, считая поле контрольной суммы заполненным пробелами
+    """
+    unsigned = sum(record[:148]) + 8 * 32 + sum(record[156:512])
+    signed = unsigned - 256 * sum(
+            1 for byte in record[:148] + record[156:512] if byte >= 128)
+    return unsigned, signed
+
+
+def verify_members(archive_name, members, algorithm=None):
+    """
+    Проверяет записи архива 'archive_name', заданные пятёрками (имя,
+    смещение заголовка, смещение данных, размер данных в архиве, хешировать
+    ли данные). Возвращает список троек (имя, описание ошибки или None,
+    хеш или None)
+    """
+    report = list()
+    with open(archive_name, 'rb') as arch:
+        archive_size = os.fstat(arch.fileno()).st_size
+        for name, header_offset, offset, size, hashed in members:
+            error = digest = None
+            record = _pread(arch, TarParser._RECORD_SIZE, header_offset)
+            padding = -size % TarParser._RECORD_SIZE
+            try:
+                checksum = parse_number(record[148:156])
+            except ValueError:
+                checksum = None
+            if len(record) < TarParser._RECORD_SIZE:
+                error = 'Header is truncated'
+            elif checksum not in header_checksum(record):
+                error = 'Header checksum mismatch'
+            elif offset + size + padding > archive_size:
+                error = 'Data is truncated'
+            elif _pread(arch, padding, offset + size).strip(b'\x00'):
+                error = 'Padding is not zeroed'
+            elif hashed and algorithm is not None:
+                hasher = hashlib.new(algorithm)
+                end = offset + size
+                while offset < end:
+                    data = _pread(
+                            arch, min(end - offset, TarParser._READ_BLOCK),
+                            offset)
+                    if not data:
+                        error = 'Data is truncated'
+                        break
+                    hasher.update(data)
+                    offset += len(data)
+                else:
+                    digest = hasher.hexdigest()
+            report.append((name, error, digest))
+    return report
+
+
+def _pread(file, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(file.fileno(), size, offset)
+    file.seek(offset)
+    return file.read(size)
 
 
 def print_file_info(stat, f=sys.stdout):
@@ -162,21 +974,44 @@ def main():
             '-l', '--list', action='store_true', dest='ls',
             help='list the contents of an archive')
     parser.add_argument(
-            '-x', '--extract', action='store_true', dest='extract',
-            help='extract files from an archive')
+            '-x', '--extract', nargs='?', const=True, dest='extract',
+            metavar='NAME',
+            help='extract files (or only the file NAME) from an archive')
+    parser.add_argument(
+            '-j', '--jobs', type=int, default=1, dest='jobs',
+            help='number of threads writing extracted files '
+            '(processes for --verify)')
+    parser.add_argument(
+            '--verify', action='store_true', dest='verify',
+            help='check all headers and data in an archive')
+    parser.add_argument(
+            '--hash', metavar='ALGORITHM', dest='algorithm',
+            help='hash file contents with ALGORITHM while verifying')
     parser.add_argument(
             '-i', '--info', action='store_true', dest='info',
             help='get information about files in an archive')
     parser.add_argument(
-            'fn', metavar='FILE',
-            help='name of an archive')
+            '--no-index', action='store_false', dest='use_index',
+            help='do not read or write the archive index file')
+    parser.add_argument(
+            'fn', metavar='FILE', nargs='?',
+            help='name of an archive (possibly compressed), - for stdin')
 
     args = parser.parse_args()
-    if not (args.ls or args.extract or args.info):
+    if args.fn is None:
+        if not isinstance(args.extract, str):
+            parser.error('the following arguments are required: FILE')
+        args.fn, args.extract = args.extract, True
+    if not (args.ls or args.extract or args.info or args.verify):
         sys.exit("Error: action must be specified")
 
     try:
-        tar = TarParser(args.fn)
+        tar = TarParser(args.fn, args.use_index)
+
+        if isinstance(args.extract, str):
+            tar.extract_member(args.extract)
+        elif args.extract:
+            tar.extract(jobs=args.jobs)
 
         if args.info:
             for fn in sorted(tar.files()):
@@ -186,8 +1021,16 @@ def main():
             for fn in sorted(tar.files()):
                 print(fn)
 
-        if args.extract:
-            tar.extract()
+        if args.verify:
+            failed = 0
+            for fn, error, digest in tar.verify(args.jobs, args.algorithm):
+                if error is not None:
+                    failed += 1
+                print('{}: {}'.format(fn, error or 'OK' + (
+                        '' if digest is None else ' ' + digest)))
+            if failed:
+                sys.exit(
+                        'Error: {} headers failed verification'.format(failed))
     except Exception as e:
         sys.exit(e)
 